@@ -13,27 +13,59 @@ It can be used to:
 
 """
 
-import openpyxl.worksheet
-import openpyxl.worksheet.datavalidation
+from __future__ import annotations
+
 import typer
+from typing import TYPE_CHECKING
 from typing_extensions import Annotated
 from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-import polars as pl
 from pathlib import Path
 import os
+import functools
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import dotenv
 from enum import Enum
-import json
-import openpyxl
 
-from file_utils import Directory, File
+# polars and xlsxwriter are heavy to import, so they are only imported in the methods that use them.
+# This keeps e.g. 'ea-cli --help' fast.
+if TYPE_CHECKING:
+    import polars as pl
+
+from file_utils import Directory, File, load_department_mapping
+
+@functools.cache
+def console() -> Console:
+    """
+    The rich console used for all output, only created when something is actually printed.
+    """
+    return Console(emoji=True, markup=True)
+
+def print(*args, **kwargs) -> None:
+    console().print(*args, **kwargs)
 
-print: callable = Console(emoji=True, markup=True).print
 dotenv.load_dotenv('settings.env')
 
+# single-character substitutions used to normalize the column names of the CopyRight export
+COLUMN_NAME_TABLE = str.maketrans({" ": "_", "*": "x"})
+
+# the columns that are read back in from the faculty & all items sheets:
+# the ones shown on the data entry sheet, plus the ones needed to compare with new CopyRight data
+SHEET_COLUMNS = ['material_id', 'last_change', 'status', 'faculty', 'url', 'workflow_status', 'manual_classification', 'scope',
+                 'remarks', 'ml_prediction', 'title', 'owner', 'author', 'department', 'course_name']
+
+def unique_path(directory: Path, stem: str, suffix: str = ".xlsx") -> Path:
+    """
+    Returns the path to the file 'stem + suffix' in directory.
+    If that file already exists, a nanosecond timestamp is added to the name instead of overwriting it.
+    """
+    path = directory / f"{stem}{suffix}"
+    if path.exists():
+        path = directory / f"{stem}_{time.time_ns():x}{suffix}"
+    return path
+
 def info(text: str):
     print(f":information: [cyan] {text} [/cyan]")
 
@@ -106,14 +138,16 @@ class EasyAccessTool:
         'copyright_import':Directory(os.getenv("COPYRIGHT_IMPORT_DIR")),
         'all_items':Directory(os.getenv("ALL_ITEMS_DIR")),
         'faculties':Directory(os.getenv("FACULTIES_DIR")),
+        'cache':Directory(os.getenv("CACHE_DIR", ".cache")),
     }
 
     raw_copyright_data: pl.DataFrame
     copyright_data: pl.DataFrame
     faculty_sheet_data: pl.DataFrame
+    faculty_groups: dict[tuple[str], pl.DataFrame]
     all_items_sheet_data: pl.DataFrame
     dept_mapping_path = File("department_mapping.json")
-    DEPARTMENT_MAPPING = json.load(open(dept_mapping_path.path, encoding='utf-8'))
+    DEPARTMENT_MAPPING = load_department_mapping(str(dept_mapping_path.path))
     faculties: list[str]
     latest_file: File
     latest_file_date: str
@@ -168,6 +202,8 @@ class EasyAccessTool:
 
 
     def read_copyright_export(self) -> None:
+        import polars as pl
+
         ...
         # determine which file to grab
         # then read it in
@@ -178,7 +214,7 @@ class EasyAccessTool:
             self.latest_file = max(all_files, key=lambda x: x.created)
             self.latest_file_date = self.latest_file.created.strftime("%Y-%m-%d")
             info(f"Selected newest file: {self.latest_file}")
-            self.raw_copyright_data = pl.read_excel(self.latest_file.path)
+            self.raw_copyright_data = self.read_cached_export(self.latest_file)
         except FileNotFoundError:
             warn(f"No files found in {self.dirs['copyright_export']}")
             raise typer.Exit(code=1)
@@ -189,7 +225,33 @@ class EasyAccessTool:
             warn("No files found in {self.dirs['copyright_export']}")
             raise typer.Exit(code=1)
 
+    def read_cached_export(self, file: File) -> pl.DataFrame:
+        """
+        Read a CopyRight export, using a parquet copy of it from the cache dir if there is one.
+        The cache key is based on the path, size and modification time of the export,
+        so a changed or replaced export is always read in again.
+        """
+        import polars as pl
+
+        stat = file.stat
+        key = hashlib.blake2b(f"{file.path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+        cache_path = self.dirs['cache'].full / f"{key}.parquet"
+        if cache_path.exists():
+            try:
+                return pl.read_parquet(cache_path)
+            except Exception:
+                warn(f"Could not read cached data {cache_path}, reading {file} instead.")
+
+        data = pl.read_excel(file.path, engine="calamine")
+        try:
+            data.write_parquet(cache_path, compression="zstd", statistics=True)
+        except OSError:
+            warn(f"Could not write cached data to {cache_path}")
+        return data
+
     def process_copyright_export(self) -> None:
+        import polars as pl
+
         # process self.raw_copyright_data
         # change the format to match the UT EA format
         # if only_changes: read in faculty sheets to create a list of all items, compare with self.raw_copyright_data
@@ -197,17 +259,25 @@ class EasyAccessTool:
         # else: don't compare and just keep the entire dataframe
         # store the result in self.copyright_data
 
-        self.copyright_data = self.raw_copyright_data.rename(
-            lambda col: col.replace(" ", "_")
-            .replace("#", "count_")
-            .replace("*", "x")
-            .lower()
+        # department -> faculty lookup table; joining on it maps each unique department once
+        department_lf = pl.LazyFrame(
+            {
+                "department": list(self.DEPARTMENT_MAPPING),
+                "faculty": list(self.DEPARTMENT_MAPPING.values()),
+            },
+            schema={"department": pl.String, "faculty": pl.String},
+        )
+
+        # build the whole pipeline lazily, so polars can optimize it before anything is materialized
+        copyright_lf = self.raw_copyright_data.lazy().rename(
+            lambda col: col.replace("#", "count_").translate(COLUMN_NAME_TABLE).lower()
             ).with_columns(
-            pl.Series("retrieved_from_copyright_on", [self.latest_file_date] * len(self.raw_copyright_data)),
-            pl.Series("workflow_status", ["ToDo"] * len(self.raw_copyright_data)),
-            faculty=pl.col("department").replace_strict(
-                self.DEPARTMENT_MAPPING, default="Unmapped"
-            ),
+            pl.lit(self.latest_file_date).alias("retrieved_from_copyright_on"),
+            pl.lit("ToDo").alias("workflow_status"),
+        ).join(
+            department_lf, on="department", how="left"
+        ).with_columns(
+            pl.col("faculty").fill_null("Unmapped")
         )
 
         if self.only_changes:
@@ -219,93 +289,100 @@ class EasyAccessTool:
                 # compare self.copyright_data with self.faculty_sheet_data
                 # only keep items from self.copyright_data with a value in col material_id that is not in self.faculty_sheet_data
                 # AND items with a matching material_id but a different value in col last_change
-                not_in_faculty = self.copyright_data.join(
-                    self.faculty_sheet_data,
+                faculty_lf = self.faculty_sheet_data.lazy().select("material_id", "last_change")
+                not_in_faculty = copyright_lf.join(
+                    faculty_lf,
                     on="material_id",
                     how="anti"
                 )
-                matching_id_diff_change = self.copyright_data.join(
-                    self.faculty_sheet_data,
+                # semi/anti joins only filter the left side, so no '_right' columns are created
+                unchanged = copyright_lf.join(
+                    faculty_lf,
+                    on=["material_id", "last_change"],
+                    how="semi"
+                )
+                matching_id_diff_change = copyright_lf.join(
+                    faculty_lf.select("material_id"),
                     on="material_id",
-                    how="inner"
-                ).filter(
-                    pl.col("last_change") != pl.col("last_change_right")
-                ).select(
-                    pl.all().exclude("last_change_right")
+                    how="semi"
+                ).join(
+                    unchanged,
+                    on="material_id",
+                    how="anti"
                 ).drop_nulls(
-                    pl.col("material_id")
+                    "material_id"
                 ).filter(
                     pl.col("status") == "Deleted"
                 )
-                self.copyright_data = pl.concat([not_in_faculty, matching_id_diff_change])
+                copyright_lf = pl.concat([not_in_faculty, matching_id_diff_change])
 
+        self.copyright_data = copyright_lf.collect()
 
-        self.faculties = self.copyright_data.select(pl.col("faculty").unique()).to_series().to_list()
+        # split the data per faculty in a single pass
+        self.faculty_groups = self.copyright_data.partition_by("faculty", as_dict=True)
+        self.faculties = [key[0] for key in self.faculty_groups]
 
     def create_faculty_sheets(self) -> None:
         # from self.copyright_data, create a sheet for each faculty (see col 'faculty')
         # store the excel files in self.dirs['faculties']
-        for faculty in self.faculties:
-            faculty_dir = Directory(self.dirs['faculties'].full / faculty)
-            if faculty is None or faculty == "":
-                faculty = "no_faculty_found"
-            filename = f"{faculty}_{self.latest_file_date}.xlsx"
-            i = 1
-            while os.path.exists(faculty_dir.full / filename):
-                filename = f"{faculty}_{self.latest_file_date}_{i}.xlsx"
-                i += 1
-
-            faculty_data = self.copyright_data.filter(pl.col("faculty") == faculty)
+        # every faculty gets its own file, so the sheets are written in parallel
+        with ThreadPoolExecutor(max_workers=min(8, max(len(self.faculties), 1))) as executor:
+            futures = [executor.submit(self._write_one_faculty, faculty, self.faculty_groups.get((faculty,), self.copyright_data.clear()))
+                       for faculty in self.faculties]
+            for future in as_completed(futures):
+                info(f"Created sheet: {future.result()}")
+
+    def _write_one_faculty(self, faculty: str, faculty_data: pl.DataFrame) -> Path:
+        """
+        Create the sheet for a single faculty from its part of the data, and return the path to the created file.
+        """
+        faculty_dir = Directory(self.dirs['faculties'].full / faculty)
+        if faculty is None or faculty == "":
+            faculty = "no_faculty_found"
+        sheet_path = unique_path(faculty_dir.full, f"{faculty}_{self.latest_file_date}")
 
-            if faculty_data.is_empty():
-                warn(f"No items found for faculty {faculty}.")
-            #TODO: create individual sheets within the excel file, for now just write the whole thing to one sheet
+        if faculty_data.is_empty():
+            warn(f"No items found for faculty {faculty}.")
+        #TODO: create individual sheets within the excel file, for now just write the whole thing to one sheet
 
-            faculty_data.write_excel(faculty_dir.full / filename)
-            info(f"Created sheet: {faculty_dir.full / filename}")
-            self.finalize_sheet(File(str(faculty_dir.full / filename)))
+        self.write_faculty_sheet(faculty_data, File(sheet_path))
+        return sheet_path
 
 
-    def finalize_sheet(self, file: File) -> None:
+    def write_faculty_sheet(self, faculty_data: pl.DataFrame, file: File) -> None:
         """
-        For a given freshly created excel file,
-        split it into multiple sheets, and add dropdowns for certain columns.
+        Write the data for a single faculty to a new excel file with two sheets:
+        'Complete data' with all columns, and 'Data entry' with only the columns needed for the checks,
+        including dropdowns for certain columns.
+        Both sheets are written in one go with xlsxwriter, so the file never has to be re-opened.
         """
+        import xlsxwriter
+        from functions import XLSX_OPTIONS
 
-        # load excel
-        wb = openpyxl.load_workbook(filename = str(file.path))
-
-        # add sheet + names
-        wb.active.title = 'Complete data'
-        entry_sheet = wb.create_sheet('Data entry')
-
-
-        keep_cols = [6, 34, 14, 16, 17, 13, 1, 8, 9, 28, 3, 5]
         col_names = ['url', 'workflow_status', 'manual_classification', 'scope', 'remarks', 'ml_prediction',
                 'material_id', 'title', 'owner', 'author', 'department', 'course_name']
 
-        for new_col, old in enumerate(keep_cols, start=1):
-            for row, cell in enumerate(wb.active.iter_rows(min_col=old, max_col=old, values_only=True), start=1):
-                entry_sheet.cell(row=row, column=new_col).value = cell[0]
-
-        # add dropdowns
-        for col, name in enumerate(col_names, start=1):
-            entry_sheet.cell(row=1, column=col, value=name)
+        # unlike the plain data sheets, these keep their urls clickable
+        with xlsxwriter.Workbook(str(file.path), {**XLSX_OPTIONS, "strings_to_urls": True}) as wb:
+            faculty_data.write_excel(workbook=wb, worksheet='Complete data')
 
+            faculty_data.select(col_names).write_excel(workbook=wb, worksheet='Data entry')
+            entry_sheet = wb.get_worksheet_by_name('Data entry')
 
-        dropdowndata = [(2,'B', '"ToDo,Done,InProgress"'), # workflow status
-                        (3,'C', '"open access, eigen materiaal - powerpoint, eigen materiaal - overig, lange overname, eigen materiaal - titelindicatie"'), # manual classification
-                        ]
-        for colnum, col_letter, itemlist in dropdowndata:
-            dv = openpyxl.worksheet.datavalidation.DataValidation(type="list", formula1=itemlist, allow_blank=False)
-            dv.error = "Please select a valid option from the list"
-            dv.errorTitle = "Invalid option"
-            dv.prompt= "Please select from the list"
-            dv.promptTitle = "List selection"
-            entry_sheet.add_data_validation(dv)
-            dv.add(f"{col_letter}1:{col_letter}1000")
-
-        wb.save(filename = str(file.path))
+            # add dropdowns
+            dropdowndata = [('B', ['ToDo', 'Done', 'InProgress']), # workflow status
+                            ('C', ['open access', 'eigen materiaal - powerpoint', 'eigen materiaal - overig', 'lange overname', 'eigen materiaal - titelindicatie']), # manual classification
+                            ]
+            for col_letter, itemlist in dropdowndata:
+                entry_sheet.data_validation(f"{col_letter}2:{col_letter}1001", {
+                    'validate': 'list',
+                    'source': itemlist,
+                    'ignore_blank': False,
+                    'error_message': "Please select a valid option from the list",
+                    'error_title': "Invalid option",
+                    'input_message': "Please select from the list",
+                    'input_title': "List selection",
+                })
 
 
 
@@ -314,14 +391,15 @@ class EasyAccessTool:
     def create_all_items_sheet(self) -> None:
         # from self.copyright_data, create a sheet with all items
         # store the excel file in self.dirs['all_items']
-        filename = f"all_items_{self.latest_file_date}.xlsx"
-        i = 1
-        while os.path.exists(self.dirs['all_items'].full / filename):
-            filename = f"all_items_{self.latest_file_date}_{i}.xlsx"
-            i += 1
-
-        self.copyright_data.write_excel(self.dirs['all_items'].full / filename)
-        info(f"Created sheet: {self.dirs['all_items'].full} / {filename}")
+        import xlsxwriter
+        from functions import XLSX_OPTIONS
+
+        sheet_path = unique_path(self.dirs['all_items'].full, f"all_items_{self.latest_file_date}")
+
+        # unlike the plain data sheets, these keep their urls clickable
+        with xlsxwriter.Workbook(str(sheet_path), {**XLSX_OPTIONS, "strings_to_urls": True}) as wb:
+            self.copyright_data.write_excel(workbook=wb)
+        info(f"Created sheet: {sheet_path}")
     def read_faculty_sheets(self) -> None:
         # read in all the faculty sheets in self.dirs['faculties']
         # combine and store in self.faculty_sheet_data
@@ -333,20 +411,31 @@ class EasyAccessTool:
         self.all_items_sheet_data  = self.read_sheets(self.dirs['all_items'].files_r)
 
     def read_sheets(self, files: list[File]) -> pl.DataFrame:
+        import fastexcel
+        import polars as pl
+
         # TODO: handle multiple sheets in the same file
         file_data = []
         for file in files:
-            current_data = pl.read_excel(file.path)
+            # only parse the columns that are used later on; columns a sheet doesn't have (e.g. older sheets) are left out,
+            # the diagonal concat below fills them with nulls
+            header = {column.name for column in fastexcel.read_excel(file.path).load_sheet(0, n_rows=0).available_columns}
+            current_data = pl.read_excel(
+                file.path,
+                engine="calamine",
+                columns=[column for column in SHEET_COLUMNS if column in header],
+            )
             current_data = self.validate_ea_sheet(current_data, file)
             if current_data.is_empty():
                 continue
             else:
-                file_data.append(current_data)
+                file_data.append(current_data.lazy())
         if file_data:
-            result: pl.DataFrame = pl.concat(file_data)
+            # diagonal_relaxed: sheets can have different columns, or different types for the same column
+            result: pl.DataFrame = pl.concat(file_data, how="diagonal_relaxed").unique().collect(streaming=True)
         else:
             result = pl.DataFrame()
-        return result.unique()
+        return result
 
     def validate_ea_sheet(self, df: pl.DataFrame, file:File) -> pl.DataFrame:
         """
@@ -355,6 +444,8 @@ class EasyAccessTool:
         If not, try to fix, else print the errors.
         If the sheet is not validated, return an empty dataframe.
         """
+        import polars as pl
+
         valid = True
         errlist = []
         # TODO: handle multiple sheets in the same file
@@ -2,6 +2,37 @@ import pathlib
 import shutil
 import os
 import datetime
+import functools
+import json
+import types
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@functools.lru_cache(maxsize=None)
+def load_department_mapping(path: str) -> types.MappingProxyType:
+    '''
+    Reads the department -> faculty mapping from a json file, with orjson if that's installed. Every file is only read and parsed once.
+    The mapping is returned as a read-only view, as it's shared between all callers.
+    '''
+    with open(path, "rb") as f:
+        raw = f.read()
+    return types.MappingProxyType(orjson.loads(raw) if orjson is not None else json.loads(raw))
+
+
+def _scandir_recursive(path: str | pathlib.Path):
+    '''
+    Yields the os.DirEntry of every file and dir below path, depth-first.
+    Symlinked dirs are not followed, same as os.walk.
+    '''
+    with os.scandir(path) as entries:
+        for entry in entries:
+            yield entry
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scandir_recursive(entry.path)
 
 
 class Directory:
@@ -11,6 +42,9 @@ class Directory:
     If the dir does not yet exist, it will be created. Disable this by setting the 'create_dir' parameter to False.
     """
 
+    # dirs that have already been checked (or created) in this process, so every File in them doesn't stat them again
+    _known_dirs: set[pathlib.Path] = set()
+
     def __init__(self, path: str, create_dir: bool = True):
         self.input_path_str = path
         self.create_dir = create_dir
@@ -28,6 +62,8 @@ class Directory:
         Checks to see if this is actually a dir,
         or create it if create_dir is set to True.
         '''
+        if self.full in Directory._known_dirs:
+            return
         if not self.full.exists():
             if self.create_dir:
                 self.create()
@@ -35,6 +71,7 @@ class Directory:
                 raise FileNotFoundError(f"Directory {self.full} does not exist and create_dir is set to False.")
         if not self.full.is_dir():
             raise NotADirectoryError(f"Directory {self.full} is not a directory.")
+        Directory._known_dirs.add(self.full)
 
 
     @property
@@ -42,32 +79,33 @@ class Directory:
         '''
         Gets all files in the dir as a list of File objects.
         '''
-        return [File(self.full / file) for file in self.full.iterdir() if file.is_file()]
+        with os.scandir(self.full) as entries:
+            return [File(pathlib.Path(entry.path), stat_result=entry.stat()) for entry in entries if entry.is_file()]
 
     @property
     def files_r(self) -> list['File']:
         '''
         Recursively gets all files in the dir, so including files in subdirs, as a list of File objects.
         '''
-        return [File(self.full / file) for file in self.full.rglob('*') if file.is_file()]
+        return [File(pathlib.Path(entry.path), stat_result=entry.stat()) for entry in _scandir_recursive(self.full) if entry.is_file()]
 
-    @property
-    def dirs(self, r: bool = False) -> list['Directory']:
+    def dirs(self, recursive: bool = False) -> list['Directory']:
         '''
         Returns a list of all dirs in this Directory as a list of Directory objects.
-        If r is set to True, it will return all children dirs recursively.
+        If recursive is set to True, it will return all children dirs recursively.
         '''
-        if not r:
-            return [Directory(self, d) for d in self.full.iterdir() if d.is_dir()]
-        if r:
-            return [Directory(self, d) for d in self.full.rglob('*') if d.is_dir()]
+        if recursive:
+            return [Directory(entry.path) for entry in _scandir_recursive(self.full) if entry.is_dir(follow_symlinks=False)]
+        with os.scandir(self.full) as entries:
+            return [Directory(entry.path) for entry in entries if entry.is_dir(follow_symlinks=False)]
+
     @property
     def newest_file(self) -> 'File':
         '''
         Returns the newest file in the dir as a File object.
         '''
         all_files = self.files
-        return max(all_files, key=lambda x: x.created())
+        return max(all_files, key=lambda x: x.created)
 
     @property
     def newest_file_r(self) -> str:
@@ -75,7 +113,7 @@ class Directory:
         Recursively gets the newest file in the dir, so including files in subdirs, as a File object.
         '''
         all_files = self.files_r
-        return max(all_files, key=lambda x: x.created())
+        return max(all_files, key=lambda x: x.created)
 
     @property
     def exists(self) -> bool:
@@ -110,16 +148,19 @@ class File:
             OR
             absolute path to the file.
             Should always end with the filename including extension.
+        stat_result: os.stat_result, optional
+            stat result for the file if it's already known (e.g. from os.scandir),
+            so it doesn't have to be retrieved again.
     '''
-    def __init__(self, path: str | pathlib.Path):
+    def __init__(self, path: str | pathlib.Path, stat_result: os.stat_result | None = None):
         self._path_init_str = str(path)
+        self._stat = stat_result
 
         assert isinstance(path, str) or isinstance(path, pathlib.Path)
 
         if isinstance(path, pathlib.Path):
             self._path = path
             self._name = path.name
-            self._extension = path.suffix
             self._dir = Directory(str(self._path.absolute().parent))
         elif isinstance(path, str):
             if '/' in path:
@@ -128,10 +169,11 @@ class File:
             else:
                 self._name = path
                 self._dir = Directory(os.getcwd())
-
-            self._extension = self._name.split('.')[-1]
             self._path = self._dir.full / self._name
 
+        # same convention for both branches: the suffix including the dot, e.g. '.xlsx'
+        self._extension = self._path.suffix
+
     @property
     def exists(self) -> bool:
         return self._path.exists()
@@ -157,12 +199,26 @@ class File:
         return self._dir
 
     @property
+    def stat(self) -> os.stat_result:
+        '''
+        The stat result for this file. Only retrieved once, and then cached.
+        '''
+        if self._stat is None:
+            self._stat = self._path.stat()
+        return self._stat
+
+    @functools.cached_property
     def created(self) -> datetime.datetime:
-        return datetime.datetime.fromtimestamp(self._path.stat().st_birthtime)
+        '''
+        Creation time of the file. Not every platform records this (e.g. Linux),
+        in which case the last modification time is used instead.
+        '''
+        stat = self.stat
+        return datetime.datetime.fromtimestamp(getattr(stat, 'st_birthtime', stat.st_mtime))
 
-    @property
+    @functools.cached_property
     def modified(self) -> datetime.datetime:
-        return datetime.datetime.fromtimestamp(self._path.stat().st_mtime)
+        return datetime.datetime.fromtimestamp(self.stat.st_mtime)
 
     def copy(self, new_path: str) -> 'File':
         shutil.copy(self._path, new_path)
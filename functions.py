@@ -1,10 +1,19 @@
 import duckdb
+import xlsxwriter
 import polars as pl
 import os
-from rich.console import Console
-import json
+import io
+import functools
+import logging
 from datetime import datetime
-from random import randint
+from typing import Literal
+import uuid
+import tempfile
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from file_utils import load_department_mapping
 '''
 Instead of using all the separate excel sheets as the main archive, use a duckdb sql database to hold the data. Keep the excel sheets for easy viewing; but use the duckdb archive for comparisons and creating new sheets and such.
 the primary duckdb sql archive should be 1 file containing all the data -- so include all columns from the excel sheets when adding to the db.
@@ -20,46 +29,101 @@ last_modified should be the date of the last modification to the item in the dat
 old_versions is a many2manyfield with the ids of all the previous versions of the item.
 '''
 
-cons = Console(emoji=True, markup=True)
-print = cons.print
+__all__ = [
+    "read_data",
+    "normalize_column_names",
+    "write_to_db",
+    "parse_periods",
+    "filter_periods",
+    "add_faculty_column",
+    "add_status_columns",
+    "process_data",
+    "process_data_direct",
+    "stage_xlsx_as_parquet",
+    "export_single_sheet",
+    "prepare_faculty_sheets",
+    "export_sheets",
+    "write_archive_dataset",
+    "read_archive_dataset",
+    "export_archive_xlsx",
+    "update_sheet",
+    "update_faculty_sheets",
+    "setup_rich_logging",
+    "XLSX_OPTIONS",
+]
+
+log = logging.getLogger("easy_access_sheets")
+
+def setup_rich_logging(level: int = logging.INFO) -> None:
+    """
+    Opt-in: show the log messages of this module on the console, formatted by rich.
+    Without this, the messages go wherever the caller's logging config sends them.
+    """
+    from rich.logging import RichHandler
+
+    if not any(isinstance(handler, RichHandler) for handler in log.handlers):
+        log.addHandler(RichHandler(show_path=False))
+    log.setLevel(level)
 
 dept_mapping_path = os.path.join(os.path.dirname(__file__), "department_mapping.json")
-DEPARTMENT_MAPPING = json.load(open(dept_mapping_path, encoding='utf-8'))
+# read-only view, so the mapping can't be changed by accident
+DEPARTMENT_MAPPING = load_department_mapping(dept_mapping_path)
 
-def read_data(filepath: str) -> pl.DataFrame:
+def read_data(filepath: str) -> pl.LazyFrame:
     """
     Given the filepath to a .csv or .xlsx file containing the exported copyRIGHT data,
-    returns it as a lazily evaluated polars DataFrame.
+    returns it as a lazily evaluated polars LazyFrame.
+
+    .xlsx files can't be scanned lazily, so they are read in once and staged as a .parquet file
+    next to the original. That file is scanned instead, and reused as long as it is newer than the .xlsx.
 
     Parameters
     ----------
     filepath : str
         The path to the .csv or .xlsx file containing the EA data.
-    rename_columns : bool, optional
-        Whether to rename the columns for consistency, by default True.
 
     Returns
     -------
-    pl.DataFrame
-        The DataFrame containing the data from the .csv file.
+    pl.LazyFrame
+        The LazyFrame containing the data from the file.
     """
     if filepath.endswith(".csv"):
         result = pl.scan_csv(
             filepath,
             null_values=["-", "", "NA", "None"],
+            low_memory=True,
+            rechunk=False,
         )
         return result
     elif filepath.endswith(".xlsx"):
-        result = pl.read_excel(
-            filepath,
-            raise_if_empty=True,
-        )
-        return result
+        return pl.scan_parquet(stage_xlsx_as_parquet(filepath))
     else:
         raise ValueError("File must be .csv or .xlsx")
 
 
-def normalize_column_names(df: pl.DataFrame) -> pl.DataFrame:
+def stage_xlsx_as_parquet(filepath: str) -> str:
+    """
+    Reads an .xlsx file once and stores it as a .parquet file next to it, so it can be scanned lazily.
+    The .parquet file is reused as long as it is newer than the .xlsx file.
+    Returns the path to the .parquet file.
+    """
+    parquet_path = filepath[: -len(".xlsx")] + ".parquet"
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(filepath):
+        pl.read_excel(
+            filepath,
+            engine="calamine",
+            raise_if_empty=True,
+        ).write_parquet(parquet_path, compression="zstd", row_group_size=64_000)
+    return parquet_path
+
+
+COLUMN_NAME_TABLE = str.maketrans({" ": "_", "*": "x"})
+
+def _normalize_column_name(col: str) -> str:
+    return col.replace("#", "count_").translate(COLUMN_NAME_TABLE).lower()
+
+
+def normalize_column_names(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
     """
     Normalizes the column names in a DataFrame:
         - Replaces spaces with underscores
@@ -69,29 +133,42 @@ def normalize_column_names(df: pl.DataFrame) -> pl.DataFrame:
 
     Parameters
     ----------
-    df : pl.DataFrame
+    df : pl.DataFrame | pl.LazyFrame
         The DataFrame to normalize the column names in.
 
     Returns
     -------
-    pl.DataFrame
+    pl.DataFrame | pl.LazyFrame
         The DataFrame with normalized column names.
     """
-    return df.rename(
-        lambda col: col.replace(" ", "_")
-        .replace("#", "count_")
-        .replace("*", "x")
-        .lower()
-    )
+    columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+    mapping = {col: new for col in columns if (new := _normalize_column_name(col)) != col}
+    return df.rename(mapping) if mapping else df
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name for use in a duckdb query, escaping any double quotes in it.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    """
+    Quote a string (e.g. a file path) as a literal in a duckdb query.
+    """
+    return "'" + value.replace("'", "''") + "'"
 
 
-def write_to_db(df: pl.DataFrame, path: str, table_name: str = "easy_access") -> None:
+def write_to_db(df: pl.DataFrame | pl.LazyFrame, path: str, table_name: str = "easy_access") -> None:
     """
     Writes a polars DataFrame to a duckdb database.
+    A LazyFrame is streamed to a temporary parquet file that duckdb reads in,
+    so the whole pipeline before it runs as a single query and is never fully held in memory.
 
     Parameters
     ----------
-    df : pl.DataFrame
+    df : pl.DataFrame | pl.LazyFrame
         The DataFrame to write to the database.
     path : str
         The path to the duckdb database. Should point to a .duckdb file.
@@ -99,21 +176,107 @@ def write_to_db(df: pl.DataFrame, path: str, table_name: str = "easy_access") ->
     if not path.endswith(".duckdb"):
         raise ValueError("Database path must be a .duckdb file")
 
-    # if the table already exists, drop it
-    with duckdb.connect(database=path, read_only=False) as con:
-        con.execute(f"DROP TABLE IF EXISTS {table_name}")
+    if isinstance(df, pl.LazyFrame):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            staged_path = os.path.join(tmp_dir, "ingest.parquet")
+            try:
+                df.sink_parquet(staged_path)
+            except pl.exceptions.InvalidOperationError:
+                # not every query can run on the streaming engine; fall back to collecting it
+                write_to_db(df.collect(streaming=True), path, table_name)
+                return
+            with duckdb.connect(database=path, read_only=False) as con:
+                con.execute(f"CREATE OR REPLACE TABLE {quote_identifier(table_name)} AS SELECT * FROM read_parquet({quote_literal(staged_path)})")
+        log.info("Stored the data in duckdb file %s", path)
+        return
 
+    # replace the table in one transaction, reading straight from the arrow buffers
     with duckdb.connect(database=path, read_only=False) as con:
-        con.execute(f"""
-            CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM df;
-            """)
+        con.begin()
+        con.register("df_arrow", df.to_arrow())
+        con.execute(f"CREATE OR REPLACE TABLE {quote_identifier(table_name)} AS SELECT * FROM df_arrow")
+        con.unregister("df_arrow")
+        con.commit()
 
-    print(
-        f":floppy_disk: Stored the data in :duck: duckdb file [magenta]{path}[/magenta]"
-    )
+    log.info("Stored the data in duckdb file %s", path)
+
+
+PERIOD_MAPPING = {
+    "1A": 1,
+    "1B": 2,
+    "2A": 3,
+    "2B": 4,
+    "3": 5,
+}
+REVERSE_PERIOD_MAPPING = {v: k for k, v in PERIOD_MAPPING.items()}
+
+
+@functools.lru_cache(maxsize=64)
+def parse_periods(periods: tuple[str, str]) -> frozenset[str]:
+    """
+    Parses the periods tuple into the set of all period strings it covers. Results are cached per tuple.
+    The tuple should be in the format (start_period, end_period)
+    This function returns a list of all period strings that are relevant to this timeframe.
+    Each period range should be a string in the format YYYY-PP,
+    with YYYY being the ACADEMIC year -- running from september to august the year after.
+    2023 will be interpreted as the academic year 2023-2024, running from september 2023 to august 2024.
+    PP is the period, one from this list: [1A, 1B, 2A, 2B]
+
+    Returns a list of strings including:
+    -> one string for each period in the period range
+        (e.g. '2023-1A', '2023-1B', '2023-2A', '2023-2B')
+    -> If a period range covers a semester (e.g. 2023-1A, 2023-1B),
+        include that semester as well (e.g. '2023-SEM1')
+    -> if a period range covers a full year (e.g. 2023-1A, 2023-2B),
+        include that year as well (e.g. '2023-JAAR')
+    -> if the period range includes a final period (-2B, e.g. 2023-2B),
+        include the '3' period as well (e.g. '2023-3')
+
+    For reference, the complete list of named periods in an academic year:
+    1A: First period (10 weeks) of the first semester of the academic year
+    1B: Second period (10 weeks) of the first semester of the academic year
+    2A: First period (10 weeks) of the second semester of the academic year
+    2B: Second period (10 weeks) of the second semester of the academic year
+    3: Third period (10 weeks) of the academic year (summer term) Not often used; include if any 2B period is included in the request.
+    SEM1: First semester of the academic year
+    SEM2: Second semester of the academic year
+    JAAR: Full academic year
+    """
+    start_period, end_period = periods
+    start_year, start_period_str = start_period.split("-")
+    end_year, end_period_str = end_period.split("-")
+
+    if (
+        start_period_str not in PERIOD_MAPPING
+        or end_period_str not in PERIOD_MAPPING
+    ):
+        raise ValueError("Invalid period format")
 
+    start_period_number = PERIOD_MAPPING[start_period_str]
+    end_period_number = PERIOD_MAPPING[end_period_str]
+    start_year, end_year = int(start_year), int(end_year)
 
-def filter_periods(df: pl.DataFrame, periods: tuple[str, str]) -> pl.DataFrame:
+    period_list = set()
+
+    for year in range(start_year, end_year + 1):
+        start = start_period_number if year == start_year else 1
+        end = end_period_number if year == end_year else 5
+
+        period_list.update(f"{year}-{REVERSE_PERIOD_MAPPING[i]}" for i in range(start, end + 1))
+
+        if start <= 2 and end >= 2:
+            period_list.add(f"{year}-SEM1")
+        if start <= 4 and end >= 4:
+            period_list.add(f"{year}-SEM2")
+        if start <= 2 and end >= 4:
+            period_list.add(f"{year}-JAAR")
+        if end >= 4:
+            period_list.add(f"{year}-3")
+
+    return frozenset(period_list)
+
+
+def filter_periods(df: pl.DataFrame | pl.LazyFrame, periods: tuple[str, str]) -> pl.DataFrame | pl.LazyFrame:
     """
     NOTE: This function is currently superfluos, as the data exported from the copyRIGHT tool is already filtered by period.
 
@@ -121,7 +284,7 @@ def filter_periods(df: pl.DataFrame, periods: tuple[str, str]) -> pl.DataFrame:
 
     Parameters
     ----------
-    df : pl.DataFrame
+    df : pl.DataFrame | pl.LazyFrame
         The DataFrame to filter the periods from.
     periods : (str, str)
         The period range to filter on.
@@ -142,97 +305,46 @@ def filter_periods(df: pl.DataFrame, periods: tuple[str, str]) -> pl.DataFrame:
         The DataFrame containing the filtered periods.
     """
 
-    def parse_periods(periods: tuple[str, str] | list[str]) -> set[str]:
-        """
-        Helper function to parse the periods tuple into a list of period strings.
-        The tuple should be in the format (start_period, end_period)
-        This function returns a list of all period strings that are relevant to this timeframe.
-        Each period range should be a string in the format YYYY-PP,
-        with YYYY being the ACADEMIC year -- running from september to august the year after.
-        2023 will be interpreted as the academic year 2023-2024, running from september 2023 to august 2024.
-        PP is the period, one from this list: [1A, 1B, 2A, 2B]
-
-        Returns a list of strings including:
-        -> one string for each period in the period range
-            (e.g. '2023-1A', '2023-1B', '2023-2A', '2023-2B')
-        -> If a period range covers a semester (e.g. 2023-1A, 2023-1B),
-            include that semester as well (e.g. '2023-SEM1')
-        -> if a period range covers a full year (e.g. 2023-1A, 2023-2B),
-            include that year as well (e.g. '2023-JAAR')
-        -> if the period range includes a final period (-2B, e.g. 2023-2B),
-            include the '3' period as well (e.g. '2023-3')
-
-        For reference, the complete list of named periods in an academic year:
-        1A: First period (10 weeks) of the first semester of the academic year
-        1B: Second period (10 weeks) of the first semester of the academic year
-        2A: First period (10 weeks) of the second semester of the academic year
-        2B: Second period (10 weeks) of the second semester of the academic year
-        3: Third period (10 weeks) of the academic year (summer term) Not often used; include if any 2B period is included in the request.
-        SEM1: First semester of the academic year
-        SEM2: Second semester of the academic year
-        JAAR: Full academic year
-        """
-        period_mapping = {
-            "1A": 1,
-            "1B": 2,
-            "2A": 3,
-            "2B": 4,
-            "3": 5,
-        }
-        reverse_mapping = {v: k for k, v in period_mapping.items()}
-
-        start_period, end_period = periods
-        start_year, start_period_str = start_period.split("-")
-        end_year, end_period_str = end_period.split("-")
-
-        if (
-            start_period_str not in period_mapping
-            or end_period_str not in period_mapping
-        ):
-            raise ValueError("Invalid period format")
-
-        start_period_number = period_mapping[start_period_str]
-        end_period_number = period_mapping[end_period_str]
-
-        period_list = set()
-
-        for year in range(int(start_year), int(end_year) + 1):
-            start = start_period_number if year == int(start_year) else 1
-            end = end_period_number if year == int(end_year) else 5
-
-            for i in range(start, end + 1):
-                period_list.add(f"{year}-{reverse_mapping[i]}")
-
-            if start <= 2 and end >= 2:
-                period_list.add(f"{year}-SEM1")
-            if start <= 4 and end >= 4:
-                period_list.add(f"{year}-SEM2")
-            if start <= 2 and end >= 4:
-                period_list.add(f"{year}-JAAR")
-            if end >= 4:
-                period_list.add(f"{year}-3")
-
-        return period_list
-
     if isinstance(periods, list):
         period_list = periods
     elif isinstance(periods, tuple):
-        period_list = list(parse_periods(periods))
+        period_list = parse_periods(periods)
     else:
         raise ValueError("Periods must be a list or tuple")
-    return df.filter(pl.col("period").is_in(period_list))
+    # casting to an Enum of the wanted periods turns every other period into null,
+    # so the filter compares small integer codes instead of hashing each string.
+    # Unlike a Categorical this doesn't need the global string cache.
+    return df.filter(
+        pl.col("period").cast(pl.Enum(sorted(set(period_list))), strict=False).is_not_null()
+    )
 
 
-def add_faculty_column(df: pl.DataFrame) -> pl.DataFrame:
+# the same mapping as a two-column frame, to join on in polars or to register in duckdb
+DEPARTMENT_TABLE = pl.DataFrame(
+    {"department": list(DEPARTMENT_MAPPING), "faculty": list(DEPARTMENT_MAPPING.values())},
+    schema={"department": pl.String, "faculty": pl.String},
+)
+
+# only a handful of faculties exist, so store them as an Enum: cheap to group, filter and partition on
+FACULTY_DTYPE = pl.Enum(sorted({*DEPARTMENT_MAPPING.values(), "Unmapped"}))
+
+# the known departments as an Enum as well, so the mapping join compares integer codes instead of strings.
+# Only used for the join key: casting the department column itself would turn unknown departments into nulls.
+DEPARTMENT_DTYPE = pl.Enum(list(DEPARTMENT_MAPPING))
+_DEPARTMENT_KEYS = DEPARTMENT_TABLE.select(
+    pl.col("department").cast(DEPARTMENT_DTYPE).alias("_department_key"), pl.col("faculty").cast(FACULTY_DTYPE)
+)
+
+def add_faculty_column(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
     """
     map each row in the DataFrame to the corresponding faculty, and add
     this to the faculty column in the DataFrame.
 
-    The mapping is included as a hardcoded dictionary in the function for now.
+    The mapping is read from department_mapping.json, and joined on as the DEPARTMENT_TABLE frame.
 
     Parameters
     ----------
-    df : pl.DataFrame
+    df : pl.DataFrame | pl.LazyFrame
         The DataFrame to add the faculty to.
 
     Returns
@@ -243,10 +355,15 @@ def add_faculty_column(df: pl.DataFrame) -> pl.DataFrame:
 
 
 
-    return df.with_columns(
-        faculty=pl.col("department").replace_strict(
-            DEPARTMENT_MAPPING, default="Unmapped"
-        )
+    mapping = _DEPARTMENT_KEYS.lazy() if isinstance(df, pl.LazyFrame) else _DEPARTMENT_KEYS
+    return df.drop("faculty", strict=False).with_columns(
+        _department_key=pl.col("department").cast(DEPARTMENT_DTYPE, strict=False)
+    ).join(
+        mapping, on="_department_key", how="left"
+    ).drop(
+        "_department_key"
+    ).with_columns(
+        pl.col("faculty").fill_null("Unmapped")
     )
 
 def add_status_columns(df: pl.DataFrame) -> pl.DataFrame:
@@ -274,7 +391,7 @@ def add_status_columns(df: pl.DataFrame) -> pl.DataFrame:
     ])
 
 
-def process_data(filepath: str, periods: tuple[str, str] | list[str], dbpath: str):
+def process_data(filepath: str, periods: tuple[str, str] | list[str], dbpath: str, direct: bool = True):
     """
     # NOTE: Currently 'periods' is not used, as the exported data is already filtered by period.
     Main function: supply a filepath to a .csv or .xlsx file containing the EA data,
@@ -304,30 +421,69 @@ def process_data(filepath: str, periods: tuple[str, str] | list[str], dbpath: st
 
     dbpath : str
         The duckdb file with the processed data will be stored here.
+    direct : bool
+        If True (default), duckdb reads the (staged) file itself and does the renames and faculty mapping
+        in the same query, so the data never has to be materialized in python (see process_data_direct).
+        If False, the data goes through the polars pipeline instead, which also filters on periods.
     """
+    if direct:
+        process_data_direct(filepath, dbpath)
+    else:
+        write_to_db(
+            read_data(filepath).pipe(normalize_column_names).pipe(filter_periods, periods).pipe(add_faculty_column),
+            path=dbpath,
+        )
 
-    '''
-    # including filter_periods
-    write_to_db(
-        add_faculty_column(
-            filter_periods(normalize_column_names(read_data(filepath)), periods)
-        ),
-        path=dbpath,
-    )
-    '''
+def process_data_direct(filepath: str, dbpath: str, table_name: str = "easy_access") -> None:
+    """
+    Loads a .csv or .xlsx file straight into duckdb: duckdb reads the file directly,
+    and the column renames and faculty mapping are done in the same sql query.
+    .xlsx files are first staged as .parquet (see stage_xlsx_as_parquet), as duckdb can't read them.
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the .csv or .xlsx file containing the EA data.
+    dbpath : str
+        The duckdb file with the processed data will be stored here.
+    """
+    if not dbpath.endswith(".duckdb"):
+        raise ValueError("Database path must be a .duckdb file")
+
+    # the file path and options are inlined as literals: parameters aren't supported everywhere in DESCRIBE and CREATE TABLE AS
+    if filepath.endswith(".csv"):
+        null_strings = ", ".join(quote_literal(null_string) for null_string in ["-", "", "NA", "None"])
+        source = f"read_csv({quote_literal(filepath)}, nullstr = [{null_strings}])"
+    elif filepath.endswith(".xlsx"):
+        source = f"read_parquet({quote_literal(stage_xlsx_as_parquet(filepath))})"
+    else:
+        raise ValueError("File must be .csv or .xlsx")
+
+    with duckdb.connect(database=dbpath, read_only=False) as con:
+        columns = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        renamed = ", ".join(f"{quote_identifier(col)} AS {quote_identifier(_normalize_column_name(col))}" for col in columns)
+
+        con.begin()
+        con.register("department_mapping", DEPARTMENT_TABLE.to_arrow())
+        con.execute(
+            f"""
+            CREATE OR REPLACE TABLE {quote_identifier(table_name)} AS
+            SELECT src.*, coalesce(m.faculty, 'Unmapped') AS faculty
+            FROM (SELECT {renamed} FROM {source}) AS src
+            LEFT JOIN department_mapping AS m ON src.department = m.department
+            """
+        )
+        con.unregister("department_mapping")
+        con.commit()
+
+    log.info("Stored the data in duckdb file %s", dbpath)
 
-    write_to_db(
-        add_faculty_column(
-            normalize_column_names(read_data(filepath))
-        ),
-        path=dbpath,
-    )
 
 def export_single_sheet(duckdb_path: str, sheets_path: str) -> None:
     """
     Same as export_sheets, but only exports a single sheet with all data.
     """
-    export_sheets(duckdb_path, sheets_path, all_faculties=False)
+    export_sheets(sheets_path=sheets_path, duckdb_path=duckdb_path, all_faculties=False)
 
 def prepare_faculty_sheets(df: pl.DataFrame, sheets_path: str, date: str|None = None) -> list[tuple[str, pl.DataFrame]]:
     """
@@ -335,36 +491,114 @@ def prepare_faculty_sheets(df: pl.DataFrame, sheets_path: str, date: str|None =
     create a list of tuples with the path to store the .xlsx, and the dataframe with that faculty's data.
     """
     df = add_status_columns(df)
-    faculties = df.select(pl.col("faculty").unique())
-    faculties = faculties.to_series().to_list()
-    resultlist: list[tuple[str, pl.DataFrame]] = []
-    for faculty in faculties:
-        if faculty is None:
-            faculty = "no_faculty_found"
-            df_faculty = df.filter(pl.col("faculty").is_null())
-        else:
-            df_faculty = df.filter(pl.col("faculty") == faculty)
+    # split the data per faculty in a single pass; missing and empty faculties end up in the same sheet
+    faculty_parts: dict[str, list[pl.DataFrame]] = {}
+    for (faculty,), df_faculty in df.partition_by("faculty", as_dict=True).items():
+        faculty_parts.setdefault(faculty or "no_faculty_found", []).append(df_faculty)
 
-        if faculty == "":
-            faculty = "no_faculty_found"
+    resultlist: list[tuple[str, pl.DataFrame]] = []
+    for faculty, parts in faculty_parts.items():
+        df_faculty = parts[0] if len(parts) == 1 else pl.concat(parts)
         sheet_name = str(faculty) + ".xlsx"
 
         if not date:
             fac_folder_path = os.path.join(sheets_path, faculty)
         else:
             fac_folder_path = os.path.join(sheets_path, faculty, date)
-        # check if path exists, if not, create it
-        if not os.path.exists(fac_folder_path):
-            os.makedirs(fac_folder_path, exist_ok=True)
+        os.makedirs(fac_folder_path, exist_ok=True)
 
         fac_sheet_path = os.path.join(fac_folder_path, sheet_name)
         resultlist.append((fac_sheet_path, df_faculty))
-        print(
-            f":floppy_disk: saved [cyan]{faculty}[/cyan] data to :clipboard: [magenta]{fac_sheet_path}[/magenta]"
-        )
+        log.info("saved %s data to %s", faculty, fac_sheet_path)
     return resultlist
 
-def export_sheets(sheets_path: str, duckdb_path: str|None = None, main_sheet_path: str|None = None, all_faculties: bool = True, date: str|None = None) -> None:
+# workbook options for all xlsx files written with xlsxwriter (here and in easy_access_cli.py): the defaults polars uses,
+# but without scanning every string for urls (these are plain data sheets), and built in memory instead of via temp files.
+# xlsxwriter's constant_memory mode can't be used: it doesn't support the tables write_excel creates.
+XLSX_OPTIONS = {
+    "nan_inf_to_errors": True,
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+    "default_date_format": "yyyy-mm-dd",
+    "in_memory": True,
+}
+
+def write_excel_file(df: pl.DataFrame, path: str) -> None:
+    """
+    Writes df to an .xlsx file at path.
+    The workbook is built in memory first and then written to disk in one go,
+    so the (slow) file write doesn't happen in small pieces while the workbook is being built.
+    """
+    buffer = io.BytesIO()
+    with xlsxwriter.Workbook(buffer, XLSX_OPTIONS) as workbook:
+        df.write_excel(workbook=workbook)
+    with open(path, "wb") as f:
+        f.write(buffer.getbuffer())
+
+
+def _to_ipc_bytes(df: pl.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    df.write_ipc(buffer)
+    return buffer.getvalue()
+
+
+def _write_faculty_xlsx(path: str, ipc_bytes: bytes) -> None:
+    """
+    Runs in a worker process: rebuilds the dataframe from arrow ipc bytes and writes it to path.
+    """
+    write_excel_file(pl.read_ipc(io.BytesIO(ipc_bytes)), path)
+
+
+ALL_SHEET_EXTENSIONS = {'xlsx': '.xlsx', 'parquet': '.parquet', 'ipc': '.arrow'}
+
+# hive-partitioned parquet dataset with the archival faculty data: <sheets_path>/archive/faculty=<faculty>/export_date=<date>/
+ARCHIVE_DATASET_DIR = 'archive'
+ARCHIVE_PARTITIONS = {"faculty": pl.String, "export_date": pl.String}
+
+def write_archive_dataset(df: pl.DataFrame, sheets_path: str, date: str) -> str:
+    """
+    Adds the faculty data for one export date to the partitioned parquet archive in sheets_path.
+    Replaces the separate .xlsx per faculty; use export_archive_xlsx to get a sheet for a faculty when needed.
+    Returns the path to the dataset.
+    """
+    dataset_path = os.path.join(sheets_path, ARCHIVE_DATASET_DIR)
+    if os.path.isdir(dataset_path):
+        with os.scandir(dataset_path) as entries:
+            for entry in entries:
+                if os.path.exists(os.path.join(entry.path, f"export_date={date}")):
+                    raise ValueError(f"The archive in {dataset_path} already has data for {date}. Please remove it before running this script again.")
+    # missing and empty faculties end up in the same partition, same as with the sheets
+    df = df.with_columns(
+        pl.col("faculty").cast(pl.String).replace("", None).fill_null("no_faculty_found"),
+        pl.lit(date).alias("export_date"),
+    )
+    df.write_parquet(dataset_path, compression="zstd", partition_by=list(ARCHIVE_PARTITIONS))
+    log.info("saved the faculty data for %s to %s", date, dataset_path)
+    return dataset_path
+
+def read_archive_dataset(sheets_path: str, faculty: str | None = None, date: str | None = None) -> pl.DataFrame:
+    """
+    Reads (part of) the partitioned parquet archive in sheets_path.
+    Filtering on faculty and/or date only reads the matching partitions.
+    """
+    lf = pl.scan_parquet(
+        os.path.join(sheets_path, ARCHIVE_DATASET_DIR, "**", "*.parquet"),
+        hive_partitioning=True,
+        hive_schema=ARCHIVE_PARTITIONS,
+    )
+    if faculty is not None:
+        lf = lf.filter(pl.col("faculty") == faculty)
+    if date is not None:
+        lf = lf.filter(pl.col("export_date") == date)
+    return lf.collect(streaming=True)
+
+def export_archive_xlsx(sheets_path: str, faculty: str, path: str, date: str | None = None) -> None:
+    """
+    Writes the archived data for one faculty (optionally for one export date) to an .xlsx file, for sharing.
+    """
+    write_excel_file(read_archive_dataset(sheets_path, faculty=faculty, date=date), path)
+
+def export_sheets(sheets_path: str, duckdb_path: str|None = None, main_sheet_path: str|None = None, all_faculties: bool = True, date: str|None = None, format: Literal['xlsx', 'parquet', 'ipc'] = 'xlsx') -> None:
     """
     Read in a duckdb file and a path to store the output.
     Then create a sheet for each faculty, and one with all data, and store it in that new map.
@@ -375,29 +609,21 @@ def export_sheets(sheets_path: str, duckdb_path: str|None = None, main_sheet_pat
         The path to the duckdb file containing the processed data.
     sheets_path : str
         The path to the folder where the sheets should be stored.
+    format : 'xlsx', 'parquet' or 'ipc'
+        File format for the file with all data. 'parquet' and 'ipc' are much faster to write than 'xlsx',
+        use them if the file is only read in again by this tool.
+        With 'parquet', the faculty data is added to a partitioned parquet dataset (see write_archive_dataset)
+        instead of written as a .xlsx per faculty.
     """
-    if duckdb_path:
-        with duckdb.connect(database=duckdb_path, read_only=True) as con:
-            df: pl.DataFrame = con.execute("SELECT * FROM easy_access").pl()
-    elif main_sheet_path:
-        df = pl.read_excel(main_sheet_path, raise_if_empty=True)
+    if format not in ALL_SHEET_EXTENSIONS:
+        raise ValueError("format must be 'xlsx', 'parquet' or 'ipc'")
 
     # add the date to column 'export_date'. If no date is given, use today's date.
-
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
-    df = df.with_columns(pl.lit(date).alias('export_date'))
 
-
-    if all_faculties:
-        faculty_sheets = prepare_faculty_sheets(df, sheets_path, date)
-        for faculty_sheet in faculty_sheets:
-            faculty_sheet_path = faculty_sheet[0]
-            df_faculty = faculty_sheet[1]
-            df_faculty.write_excel(faculty_sheet_path)
-
-    # check if sheets_path\all.xlsx exists. If it does, raise error.
-    sheet_name = 'all.xlsx'
+    # check if sheets_path\all.xlsx (or .parquet/.arrow) exists. If it does, raise error.
+    sheet_name = 'all' + ALL_SHEET_EXTENSIONS[format]
     if date:
         all_folder_path = os.path.join(sheets_path, 'all', date)
     else:
@@ -409,11 +635,55 @@ def export_sheets(sheets_path: str, duckdb_path: str|None = None, main_sheet_pat
 
     if os.path.exists(all_sheet_path):
         raise ValueError(f"File {all_sheet_path} already exists. Please delete it or rename it before running this script again.")
+
+    if duckdb_path and format == 'parquet' and not all_faculties:
+        # nothing has to be done in python: let duckdb write the parquet file directly
+        with duckdb.connect(database=duckdb_path, read_only=True) as con:
+            con.execute(
+                f"COPY (SELECT *, {quote_literal(date)} AS export_date FROM easy_access) TO {quote_literal(all_sheet_path)} "
+                "(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 64000)"
+            )
+        log.info("saved the full list to %s", all_sheet_path)
+        return
+
+    if duckdb_path:
+        # let duckdb add the export date while reading, instead of copying the frame again in polars
+        with duckdb.connect(database=duckdb_path, read_only=True) as con:
+            df: pl.DataFrame = pl.from_arrow(
+                con.execute(f"SELECT *, {quote_literal(date)} AS export_date FROM easy_access").arrow(), rechunk=False
+            )
+    elif main_sheet_path:
+        if main_sheet_path.endswith(".parquet"):
+            df = pl.read_parquet(main_sheet_path)
+        elif main_sheet_path.endswith(".arrow"):
+            df = pl.read_ipc(main_sheet_path)
+        else:
+            # reads the parquet copy next to the .xlsx if it's up to date, much faster than parsing the xlsx
+            df = pl.read_parquet(stage_xlsx_as_parquet(main_sheet_path))
+        df = df.with_columns(pl.lit(date).alias('export_date'))
+
+    if all_faculties and format == 'parquet':
+        write_archive_dataset(add_status_columns(df), sheets_path, date)
+    elif all_faculties:
+        faculty_sheets = prepare_faculty_sheets(df, sheets_path, date)
+        # the sheets are independent files and writing xlsx is cpu-bound, so write them in separate processes.
+        # the data is sent over as arrow ipc bytes, which is much cheaper than pickling the dataframes
+        if faculty_sheets:
+            # spawn, not fork: a forked child can deadlock on the polars thread pool of this process
+            with ProcessPoolExecutor(max_workers=min(len(faculty_sheets), os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(_write_faculty_xlsx, path, _to_ipc_bytes(df_faculty)) for path, df_faculty in faculty_sheets]
+                for future in futures:
+                    future.result()
+
+    if format == 'parquet':
+        df.write_parquet(all_sheet_path, compression='zstd', statistics=True, row_group_size=64_000)
+    elif format == 'ipc':
+        df.write_ipc(all_sheet_path, compression='zstd')
     else:
-        df.write_excel(all_sheet_path)
-        print(
-            f':floppy_disk: saved the [cyan]full list[/cyan] to :clipboard: [magenta]{all_sheet_path}[/magenta]'
-        )
+        write_excel_file(df, all_sheet_path)
+        # parquet copy, so the next run can read this file back without parsing the xlsx (see stage_xlsx_as_parquet)
+        df.write_parquet(all_sheet_path[: -len(".xlsx")] + ".parquet", compression="zstd", compression_level=3)
+    log.info("saved the full list to %s", all_sheet_path)
 
 def update_sheet(sheet_path: str, new_data_path: str|pl.DataFrame, print_diffs: bool = False) -> None:
     """
@@ -422,18 +692,20 @@ def update_sheet(sheet_path: str, new_data_path: str|pl.DataFrame, print_diffs:
     """
     today = datetime.now().strftime("%Y-%m-%d")
 
-    # the added random number is a kludge to avoid overwriting existing backups
-    # replace with uuid (a variant that's also time-based)
-    backup_path = sheet_path.replace(".xlsx", f"_backup_{today}+{randint(1111111111111111,9999999999999999)}.xlsx")
+    # the uuid keeps backups made on the same day from overwriting each other
+    # uuid7 is time-ordered, but only available from python 3.14 on
+    backup_id = getattr(uuid, "uuid7", uuid.uuid4)().hex
+    backup_path = sheet_path.replace(".xlsx", f"_backup_{today}_{backup_id}.xlsx")
 
     # find the current living worksheet
     try:
-        cur_sheet = pl.read_excel(sheet_path, raise_if_empty=False)
-        # store a backup
-        cur_sheet.write_excel(backup_path)
-        print('written backup to', backup_path)
+        cur_sheet = pl.read_excel(sheet_path, engine="calamine", raise_if_empty=False)
+        # store a backup: a plain copy of the file, no need to encode the sheet again.
+        # (not a hardlink: the sheet is overwritten in place below, which would change the backup too)
+        shutil.copyfile(sheet_path, backup_path)
+        log.info("written backup to %s", backup_path)
     except FileNotFoundError:
-        print(f"Sheet {sheet_path} does not exist yet. Creating a new one.")
+        log.info("Sheet %s does not exist yet. Creating a new one.", sheet_path)
         cur_sheet = pl.DataFrame()
 
 
@@ -442,12 +714,12 @@ def update_sheet(sheet_path: str, new_data_path: str|pl.DataFrame, print_diffs:
         raise ValueError(f"Backup was not made, stopping script. Please check that the backup file {backup_path} exists.")
 
     new_data = pl.DataFrame()
-    print(new_data_path)
+    log.debug("new data: %s", new_data_path)
     if isinstance(new_data_path, str):
         try:
-            new_data = pl.read_excel(new_data_path, raise_if_empty=True)
+            new_data = pl.read_excel(new_data_path, engine="calamine", raise_if_empty=True)
         except pl.exceptions.NoDataError:
-            print(f"Empty file found in {new_data_path}. No changes were made.")
+            log.info("Empty file found in %s. No changes were made.", new_data_path)
             return
     elif isinstance(new_data_path, pl.DataFrame):
         new_data = new_data_path
@@ -455,46 +727,54 @@ def update_sheet(sheet_path: str, new_data_path: str|pl.DataFrame, print_diffs:
     # add the column 'added_to_sheet_on' to new data, containing today's date
     new_data = new_data.with_columns(pl.lit(today).alias('added_to_sheet_on'))
 
-    print(cur_sheet.head())
-    print(cur_sheet.schema)
-    print(new_data.head())
-    print(new_data.schema)
+    log.debug("current sheet:\n%s\n%s", cur_sheet.head(), cur_sheet.schema)
+    log.debug("new data:\n%s\n%s", new_data.head(), new_data.schema)
 
-    # set all columns with type 'Null' to 'String'
-    new_data = new_data.with_columns([pl.when(pl.col(col).is_null()).then(pl.lit("")).otherwise(pl.col(col)).alias(col) for col in new_data.columns])
-    cur_sheet = cur_sheet.with_columns([pl.when(pl.col(col).is_null()).then(pl.lit("")).otherwise(pl.col(col)).alias(col) for col in cur_sheet.columns])
+    # turn all columns into strings and replace nulls with empty strings, so both frames can be stacked
+    new_data = new_data.select(pl.all().cast(pl.String).fill_null(""))
+    cur_sheet = cur_sheet.select(pl.all().cast(pl.String).fill_null(""))
 
     #new items: all rows in new_data that have a material_id not in cur_sheet
-    new_items = new_data.filter(~pl.col("material_id").is_in(cur_sheet["material_id"]))
-    print(new_items.head())
-    print(new_items.schema)
+    new_items = new_data.join(cur_sheet.select("material_id"), on="material_id", how="anti")
+    log.debug("new items:\n%s\n%s", new_items.head(), new_items.schema)
 
     new_sheet = pl.concat([cur_sheet, new_items], how="vertical")
 
     # check if merged as the same number of rows as cur_sheet
     if len(new_sheet) == len(cur_sheet):
-        print(f"No new items found while adding to {sheet_path}. New data has {len(new_data)}, the old data has {len(cur_sheet)} rows.")
-        print("No changes were made.")
+        log.info("No new items found while adding to %s. New data has %d, the old data has %d rows.", sheet_path, len(new_data), len(cur_sheet))
+        log.info("No changes were made.")
         return
     else:
-        new_sheet.write_excel(sheet_path)
-        print(f"Updated {sheet_path} with {len(new_sheet)-len(cur_sheet)} new items.")
-        print("note: writing is temporarily disabled for testing")
+        write_excel_file(new_sheet, sheet_path)
+        log.info("Updated %s with %d new items.", sheet_path, len(new_sheet) - len(cur_sheet))
 
     # Compare cur_sheet and new_data. For each matching 'material_id', check if any of the other columns have changed. If so, print the differences.
-    common_ids = cur_sheet.select("material_id").filter(pl.col("material_id").is_in(new_data["material_id"]))
-
-    # Compare the corresponding rows and print any differences
-    for material_id in common_ids["material_id"]:
-        cur_row = cur_sheet.filter(pl.col("material_id") == material_id).to_dict(as_series=False)
-        new_row = new_data.filter(pl.col("material_id") == material_id).to_dict(as_series=False)
+    # This is done with a single join, so only the rows that actually changed are looked at one by one.
+    diff_cols = [col for col in cur_sheet.columns if col != "material_id" and col in new_data.columns]
+    if not print_diffs or not diff_cols:
+        return
 
-        differences = {key: (cur_row[key], new_row[key]) for key in cur_row if cur_row[key] != new_row[key]}
+    joined = cur_sheet.join(
+        new_data.select("material_id", *diff_cols), on="material_id", how="inner", suffix="__new"
+    ).with_row_index("_row").lazy()
+    # one long (row, material_id, column, old, new) frame with only the values that differ
+    differences = pl.concat(
+        joined.select(
+            "_row",
+            "material_id",
+            pl.lit(col).alias("column"),
+            pl.col(col).cast(pl.String).alias("old"),
+            pl.col(f"{col}__new").cast(pl.String).alias("new"),
+        )
+        for col in diff_cols
+    ).filter(
+        pl.col("old").ne_missing(pl.col("new"))
+    ).sort("_row", maintain_order=True).collect()
 
-        if differences:
-            print(f"Differences for material_id {material_id}:")
-            print(differences)
-            print('\n')
+    for (_, material_id), row_diffs in differences.partition_by(["_row", "material_id"], as_dict=True, maintain_order=True).items():
+        changes = dict(zip(row_diffs["column"], zip(row_diffs["old"], row_diffs["new"])))
+        log.info("Differences for material_id %s:\n%s\n", material_id, changes)
 
 
 def update_faculty_sheets(cip_worksheet_path: str, faculty_worksheets_base_path: str, print_diffs: bool = False) -> None:
@@ -504,7 +784,7 @@ def update_faculty_sheets(cip_worksheet_path: str, faculty_worksheets_base_path:
     """
 
     date = datetime.now().strftime("%Y-%m-%d")
-    df = pl.read_excel(cip_worksheet_path, raise_if_empty=True)
+    df = pl.read_excel(cip_worksheet_path, engine="calamine", raise_if_empty=True)
     new_faculty_worksheets = prepare_faculty_sheets(df, faculty_worksheets_base_path, date)
     for sheet in new_faculty_worksheets:
         update_sheet(sheet_path=sheet[0], new_data_path=sheet[1], print_diffs=print_diffs)
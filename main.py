@@ -1,7 +1,7 @@
 import os
-import glob
+import re
 import datetime
-from functions import process_data, export_sheets, update_faculty_sheets, update_sheet
+from functions import process_data, export_sheets, update_faculty_sheets, update_sheet, setup_rich_logging
 from rich.console import Console
 import sys
 from pathlib import Path
@@ -24,14 +24,20 @@ FACULTY_LIVING_SHEETS_PATH = cur_dir.parent.parent.parent / "Faculty Sheets"
 
 ALL_PERIOD_SUFFIXES = ["1A", "1B", "2A", "2B", "3", "SEM1", "SEM2", "JAAR"]
 
+EXPORT_FILENAME_RE = re.compile(r"export_(\d{2}_\d{2}_\d{4})\.xlsx")
+
 
 def get_latest_file(path: str) -> str:
     """
     Returns the path to the most recent file in a directory.
     """
-    files = glob.glob(os.path.join(path, "*.xlsx"))
-    files.sort(key=os.path.getmtime)
-    return files[-1]
+    # a single pass over the directory entries; the mtime comes from the entry so every file is only stat'ed once
+    with os.scandir(path) as entries:
+        latest = max(
+            (entry for entry in entries if entry.name.endswith(".xlsx") and not entry.name.startswith(".") and entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime_ns,
+        )
+    return latest.path
 
 
 def get_date(path: str) -> datetime.datetime:
@@ -39,11 +45,10 @@ def get_date(path: str) -> datetime.datetime:
     Returns the date of a file in the format YYYY-MM-DD.
     """
     # first check if the file is named 'export_DD_MM_YYYY.xlsx'
-    if os.path.basename(path).startswith('export_') and os.path.basename(path).endswith('.xlsx') and len(os.path.basename(path)) == 19:
-        return datetime.datetime.strptime(os.path.basename(path)[7:], '%d_%m_%Y')
-    else:
+    if match := EXPORT_FILENAME_RE.fullmatch(os.path.basename(path)):
+        return datetime.datetime.strptime(match.group(1), '%d_%m_%Y')
     # if not, return the created time of the file.
-        return datetime.datetime.fromtimestamp(os.path.getctime(path))
+    return datetime.datetime.fromtimestamp(os.path.getctime(path))
 
 
 def get_export_path(date: datetime.datetime | None = None, export_folder: str = '') -> str:
@@ -52,10 +57,9 @@ def get_export_path(date: datetime.datetime | None = None, export_folder: str =
     """
     if date is None:
         export_path = os.path.join(export_folder)
-        os.makedirs(export_path, exist_ok=True)
     else:
         export_path = os.path.join(export_folder, date.strftime("%Y-%m-%d"))
-        os.makedirs(export_path, exist_ok=True)
+    os.makedirs(export_path, exist_ok=True)
 
     return export_path
 
@@ -66,7 +70,7 @@ def check_if_file_exists(path: str) -> None:
     If it does, it will ask the user if they want to continue.
     If they say no, it will stop the script.
     """
-    if os.path.exists(path):
+    if file_exists(path):
         print(
             f" :warning:  File [magenta]{path}[/magenta] already exists. Do you want to [red]overwrite[/red] it? \nEnter [cyan]y and press enter[/cyan] to continue, any [cyan]other key + enter[cyan] to abort."
         )
@@ -120,12 +124,13 @@ def get_latest_export(export_folder: str) -> tuple[str, datetime.datetime]:
     For a given export folder, scan all the foldernames. These should all have the format YYYY-MM-DD.
     Return the path to the folder with the latest date and the date of the folder.
     """
-    with os.scandir(os.path.join(os.getcwd(), export_folder)) as mydir:
+    folder = os.path.join(os.getcwd(), export_folder)
+    with os.scandir(folder) as mydir:
         dirs = [i.name for i in mydir if i.is_dir()]
 
     dates = [datetime.datetime.strptime(dir, "%Y-%m-%d") for dir in dirs]
     latest_date = max(dates)
-    latest_folder = os.path.join(os.getcwd(), export_folder, latest_date.strftime("%Y-%m-%d"))
+    latest_folder = os.path.join(folder, latest_date.strftime("%Y-%m-%d"))
     return latest_folder, latest_date
 
 def file_exists(path: str) -> bool:
@@ -134,10 +139,7 @@ def file_exists(path: str) -> bool:
     If it does, return True.
     If it doesn't, return False.
     """
-    if os.path.exists(path):
-        return True
-    else:
-        return False
+    return os.path.exists(path)
 
 
 
@@ -220,6 +222,7 @@ if __name__ == "__main__":
         --archive faculty
         --archive cip faculty
     '''
+    setup_rich_logging()
     if len(sys.argv) > 1:
         if '--archive' in sys.argv:
             if any(arg in sys.argv for arg in ['cip', 'faculty']):
@@ -5,56 +5,370 @@ from rich.console import Console
 import datetime
 import uuid
 import os
-import json
+import logging
+import sys
+import functools
+import heapq
+import pathlib
+import io
+import re
+import zipfile
+import tempfile
+from xml.sax.saxutils import escape
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import ibis
 
-from file_utils import Directory, File
+from file_utils import Directory, File, load_department_mapping
 
 print = Console(emoji=True, markup=True).print
+log = logging.getLogger("easy_access_sheets")
 dotenv.load_dotenv('settings.env')
 
+# duckdb extensions with xlsx support: (extension, repository to install it from, table function to read xlsx with)
+# sheetreader is a multi-threaded community extension, read_xlsx comes with the core excel extension (duckdb >= 1.2)
+XLSX_EXTENSIONS = (("sheetreader", "community", "sheetreader"), ("excel", None, "read_xlsx"))
+
+# (extension, table function) of a duckdb xlsx reader
+XlsxReader = tuple[str, str]
+
+# the duckdb xlsx reader (or None) and whether duckdb can write xlsx, as found by xlsx_backends()
+_xlsx_backends: tuple[XlsxReader | None, bool] | None = None
+
+
+def install_xlsx_extensions() -> None:
+    """
+    Downloads and installs the duckdb extensions in XLSX_EXTENSIONS. Needs network access; run this once as a setup step.
+    Without them, xlsx files are read with polars and written with _fast_write_xlsx.
+    """
+    con = duckdb.connect()
+    try:
+        for extension, repository, _ in XLSX_EXTENSIONS:
+            try:
+                con.sql(f"INSTALL {extension}{' FROM ' + repository if repository else ''};")
+                log.info(f"Installed duckdb {extension} extension.")
+            except duckdb.Error as e:
+                log.warning(f"Could not install duckdb {extension} extension: {e}")
+    finally:
+        con.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _extension_connection(extension: str) -> duckdb.DuckDBPyConnection | None:
+    """
+    In-memory duckdb connection with the given extension loaded, shared by everything that needs that extension.
+    Only loads extensions that are already installed (see install_xlsx_extensions); nothing is downloaded here.
+    Returns None if the extension can't be loaded, so we only try once.
+    """
+    con = duckdb.connect()
+    try:
+        con.sql(f"LOAD {extension};")
+    except duckdb.Error as e:
+        log.info(f"duckdb {extension} extension not available, using the fallback instead: {e}")
+        con.close()
+        return None
+    return con
+
+
+def _find_xlsx_reader() -> XlsxReader | None:
+    """
+    The first duckdb xlsx reader in XLSX_EXTENSIONS that works. None if neither is available.
+    """
+    for extension, _, function in XLSX_EXTENSIONS:
+        con = _extension_connection(extension)
+        if con is not None and con.execute("SELECT count(*) FROM duckdb_functions() WHERE function_name = ?", [function]).fetchone()[0]:
+            return extension, function
+    return None
+
+
+def _find_xlsx_writer() -> bool:
+    """
+    Whether the excel extension can write xlsx files (duckdb >= 1.2).
+    Checked once with a tiny test file, instead of failing (and warning) on every write.
+    """
+    con = _extension_connection("excel")
+    if con is None:
+        return False
+    with tempfile.TemporaryDirectory() as tmp:
+        probe_literal = "'" + os.path.join(tmp, "probe.xlsx").replace("'", "''") + "'"
+        try:
+            con.execute(f"COPY (SELECT 1 AS probe) TO {probe_literal} (FORMAT xlsx, HEADER true)")
+        except duckdb.Error as e:
+            # older duckdb versions can load the extension but can't write xlsx with it yet
+            log.info(f"duckdb can't write xlsx files, writing them directly instead: {e}")
+            return False
+    return True
+
+
+def xlsx_backends() -> tuple[XlsxReader | None, bool]:
+    """
+    The duckdb xlsx reader to use (or None) and whether duckdb can write xlsx. Found once per process.
+    The result can be passed to worker processes with use_xlsx_backends(), so they don't look again.
+    """
+    global _xlsx_backends
+    if _xlsx_backends is None:
+        _xlsx_backends = (_find_xlsx_reader(), _find_xlsx_writer())
+    return _xlsx_backends
+
+
+def use_xlsx_backends(backends: tuple[XlsxReader | None, bool]) -> None:
+    """
+    Use the xlsx_backends() found by another process.
+    """
+    global _xlsx_backends
+    _xlsx_backends = backends
+
+
+def _xlsx_reader() -> tuple[duckdb.DuckDBPyConnection, str] | None:
+    """
+    The duckdb connection and table function to read xlsx files with, None if there is no duckdb reader.
+    """
+    reader = xlsx_backends()[0]
+    if reader is None:
+        return None
+    extension, function = reader
+    con = _extension_connection(extension)
+    return (con, function) if con is not None else None
+
+# the fixed parts of a minimal xlsx file with a single worksheet, see _fast_write_xlsx
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# control characters that aren't allowed in xml, not even escaped
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _column_letter(index: int) -> str:
+    """
+    0 -> A, 25 -> Z, 26 -> AA, ...
+    """
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _fast_write_xlsx(df: pl.DataFrame, path, batch_size: int = 10_000) -> None:
+    """
+    Writes df to an xlsx file by streaming the worksheet xml straight into the zip file, with every value as an inline string.
+    No formatting at all, but a lot faster than xlsxwriter, which handles every cell separately.
+    """
+    letters = [_column_letter(i) for i in range(df.width)]
+
+    def row_xml(row_number: int, values) -> str:
+        cells = "".join(
+            f'<c r="{letter}{row_number}" t="inlineStr"><is><t xml:space="preserve">{escape(_ILLEGAL_XML_CHARS.sub("", value))}</t></is></c>'
+            for letter, value in zip(letters, values)
+            if value is not None
+        )
+        return f'<row r="{row_number}">{cells}</row>'
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, content in _XLSX_PARTS.items():
+            zf.writestr(name, content)
+        with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(row_xml(1, df.columns).encode())
+            row_number = 2
+            for batch in df.select(pl.all().cast(pl.String)).iter_slices(batch_size):
+                rows = []
+                for values in batch.iter_rows():
+                    rows.append(row_xml(row_number, values))
+                    row_number += 1
+                sheet.write("".join(rows).encode())
+            sheet.write(b"</sheetData></worksheet>")
+
+
+def _xlsx_writer() -> duckdb.DuckDBPyConnection | None:
+    """
+    The duckdb connection to write xlsx files with, None if duckdb can't write xlsx.
+    """
+    return _extension_connection("excel") if xlsx_backends()[1] else None
+
+def write_xlsx(df: pl.DataFrame, path) -> None:
+    """
+    Writes df to an xlsx file with duckdb's excel extension (C++ writer) if available, otherwise with _fast_write_xlsx.
+    """
+    con = _xlsx_writer()
+    if con is None:
+        _fast_write_xlsx(df, path)
+        return
+    path_literal = "'" + str(path).replace("'", "''") + "'"
+    con.register("xlsx_out", df.to_arrow())
+    try:
+        con.execute(f"COPY xlsx_out TO {path_literal} (FORMAT xlsx, HEADER true)")
+    finally:
+        con.unregister("xlsx_out")
+
+def read_xlsx(path, raise_if_empty: bool = False, columns: list[str] | None = None) -> pl.DataFrame:
+    """
+    Reads the first sheet of an xlsx file into a polars dataframe, optionally only the given columns.
+    Uses one of duckdb's xlsx readers if available (see _xlsx_reader), otherwise polars + calamine.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    reader = _xlsx_reader()
+    if reader is None:
+        try:
+            return pl.read_excel(path, engine="calamine", raise_if_empty=raise_if_empty, columns=columns)
+        except ImportError:
+            # calamine needs fastexcel, which doesn't have wheels for every platform
+            return pl.read_excel(path, engine="openpyxl", raise_if_empty=raise_if_empty, columns=columns)
+    con, function = reader
+    select = ", ".join('"' + col.replace('"', '""') + '"' for col in columns) if columns else "*"
+    df = con.execute(f"SELECT {select} FROM {function}(?)", [str(path)]).pl()
+    if raise_if_empty and df.is_empty():
+        raise pl.exceptions.NoDataError(f"empty Excel sheet: {path}")
+    return df
+
+# any xlsx with a sheet in it is larger than this (the zip with the required xml parts alone is ~1.5kB, see _fast_write_xlsx)
+MIN_XLSX_SIZE = 1024
+
+# the date stamped on new sheet rows and backups; fixed at import, so it can't change halfway through a run
+TODAY_STR = datetime.date.today().isoformat()
+
 class Sheet:
     """
     Manipulate/read/write/copy/compare/update a single worksheet.
     """
 
-    def __init__(self, worksheet_file: File, sheet_type: str):
+    def __init__(self, worksheet_file: File, sheet_type: str, archive_format: str | None = None, archive: 'Archive | None' = None, today: str | None = None):
         """
         Initialize the class with the path to the worksheet file.
         sheet_type should be 'all' or one of the faculty abbreviations (e.g. 'TNW', 'ITC', etc).
+        archive_format is 'xlsx' (default) or 'parquet', or set with the SHEET_ARCHIVE_FORMAT env var.
+        With 'parquet', the sheet is stored next to the worksheet file as .parquet and an xlsx is only written by export_xlsx().
+        archive is only opened when it's needed if not passed in.
+        today is the date stamped on new rows and backups, TODAY_STR if not passed in.
         """
         self.file = worksheet_file
         self.path = worksheet_file.path
+        self.archive_format: str = archive_format or os.getenv("SHEET_ARCHIVE_FORMAT", "xlsx")
+        if self.archive_format not in ('xlsx', 'parquet'):
+            raise ValueError(f"Unknown archive format {self.archive_format}, should be 'xlsx' or 'parquet'.")
+        self._archive: Archive | None = archive
+        self.sheet_type: str = sheet_type
+        self.today: str = today or TODAY_STR
+        self.new_item_count: int = 0
+
+    @functools.cached_property
+    def current_sheet_data(self) -> pl.DataFrame:
+        """
+        All data currently in the sheet. Only read when it's first used.
+        """
+        return self.read_sheet_data()
+
+    @functools.cached_property
+    def material_ids(self) -> pl.DataFrame:
+        """
+        Just the material_id column of the sheet, which is all update() needs to find the new items.
+        Reads only that column, unless the full sheet was already loaded.
+        """
+        if 'current_sheet_data' in self.__dict__:
+            data = self.current_sheet_data
+            return data.select("material_id") if not data.is_empty() else data
+        ids = self.read_sheet_data(columns=["material_id"])
+        if ids.width == 0:
+            # missing or empty file: there's nothing more to read later either
+            self.current_sheet_data = ids
+        return ids
+
+    def read_sheet_data(self, columns: list[str] | None = None) -> pl.DataFrame:
+        """
+        Reads the current data of the sheet, optionally only the given columns.
+        Missing files, and files too small to hold any data, give an empty dataframe without parsing anything.
+        """
+        cache_path = self.path.with_suffix('.parquet')
+        if self.archive_format == 'parquet' and cache_path.exists():
+            return pl.read_parquet(cache_path, columns=columns)
         try:
-            self.current_sheet_data: pl.DataFrame = pl.read_excel(self.path, raise_if_empty=True)
+            stat = self.path.stat()
         except FileNotFoundError:
-            print(f"File {worksheet_file} does not exist. Creating a new one.")
-            self.current_sheet_data = pl.DataFrame()
-        self.archive: Archive = Archive()
-        self.sheet_type: str = sheet_type
+            print(f"File {self.file} does not exist. Creating a new one.")
+            return pl.DataFrame()
+        size = stat.st_size
+        try:
+            # save() leaves a parquet copy next to the xlsx; use it unless the xlsx was edited after it was written
+            if cache_path.stat().st_mtime_ns >= stat.st_mtime_ns:
+                return pl.read_parquet(cache_path, columns=columns)
+        except FileNotFoundError:
+            pass
+        if size < MIN_XLSX_SIZE:
+            print(f"File {self.file} is empty. It will be overwritten.")
+            return pl.DataFrame()
+        return read_xlsx(self.path, columns=columns)
+
+    @property
+    def archive(self) -> 'Archive':
+        if self._archive is None:
+            self._archive = default_archive()
+        return self._archive
 
-    def update(self) -> None:
+    def update(self, archive_items: pl.DataFrame | None = None) -> None:
         """
         Takes the worksheet, compares the data to what's in duckdb for this faculty (or 'all' if it's the main worksheet), and updates the worksheet with the new data.
+        If archive_items is passed (the archive rows for this sheet), those are used instead of querying duckdb.
         """
 
-        if self.sheet_type == 'all':
-            archive_items = self.archive.get()
-        else:
-            archive_items = self.archive.get(search_terms=[('faculty',str(self.sheet_type))])
-
-        if self.current_sheet_data.is_empty():
-            new_items = archive_items
+        faculty = None if self.sheet_type == 'all' else str(self.sheet_type)
+        # only the ids are read to find the new items; the full sheet is only read if there is something to add
+        if archive_items is not None:
+            new_items = archive_items if self.material_ids.is_empty() else archive_items.lazy().join(
+                self.material_ids.lazy(),
+                left_on=pl.col("material_id").cast(pl.String),
+                right_on=pl.col("material_id").cast(pl.String),
+                how="anti",
+            ).collect(streaming=True)
+        elif self.material_ids.is_empty():
+            new_items = self.archive.get(search_terms=[('faculty', faculty)] if faculty else None)
         else:
-            new_items = archive_items.filter(~pl.col("material_id").is_in(self.current_sheet_data["material_id"]))
+            new_items = self.archive.get_new(self.material_ids, faculty=faculty)
 
-        # add column 'added_to_sheet_on' to new data, containing today's date
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        new_items = new_items.with_columns(pl.lit(today).alias('added_to_sheet_on'))
+        self.new_item_count = new_items.height
         if not new_items.is_empty():
-            new_items = new_items.with_columns([pl.when(pl.col(col).is_null()).then(pl.lit("")).otherwise(pl.col(col)).alias(col) for col in new_items.columns])
-            self.current_sheet_data = self.current_sheet_data.with_columns([pl.when(pl.col(col).is_null()).then(pl.lit("")).otherwise(pl.col(col)).alias(col) for col in self.current_sheet_data.columns])
-            self.new_sheet_data = pl.concat([self.current_sheet_data, new_items], how="vertical")
+            # add column 'added_to_sheet_on' to new data, containing today's date
+            # kept lazy: save() sinks it straight to parquet, or collects it (streaming) only for xlsx output
+            # nulls become empty strings once, after the concat, instead of rewriting both frames first
+            self.new_sheet_data: pl.LazyFrame | pl.DataFrame = (
+                pl.concat(
+                    [self.current_sheet_data.lazy(), new_items.lazy().with_columns(pl.lit(self.today).alias('added_to_sheet_on'))],
+                    how="diagonal_relaxed",
+                )
+                .select(pl.all().cast(pl.String).fill_null(""))
+            )
             self.save()
         else:
             print(f"No new items to add to the archive for {self.sheet_type}.")
@@ -64,32 +378,72 @@ class Sheet:
         """
         for each row, get the differences between the current worksheet and the same rows in the archive
         """
-        all_ids = self.current_sheet_data.select(pl.col("material_id")).unique().to_dicts()
-        archive_data = self.archive.get(search_terms=all_ids)
+        archive_data = self.archive.get(ids=self.material_ids["material_id"].unique())
+        common_cols = [c for c in self.current_sheet_data.columns if c != "material_id" and c in archive_data.columns]
+        if not common_cols:
+            return
 
-        common_ids = self.current_sheet_data.select("material_id").filter(pl.col("material_id").is_in(archive_data["material_id"]))
-        for material_id in common_ids["material_id"]:
-            cur_row = self.current_sheet_data.filter(pl.col("material_id") == material_id).to_dict(as_series=False)
-            new_row = archive_data.filter(pl.col("material_id") == material_id).to_dict(as_series=False)
-            differences = {key: (cur_row[key], new_row[key]) for key in cur_row if cur_row[key] != new_row[key]}
+        # one join instead of filtering both frames per material_id
+        # the sheet holds everything as strings, so the ids are compared as strings (same as in update())
+        joined = self.current_sheet_data.join(
+            archive_data,
+            left_on=pl.col("material_id").cast(pl.String),
+            right_on=pl.col("material_id").cast(pl.String),
+            how="inner",
+            suffix="_archive",
+        )
+        diffs = joined.select(
+            pl.col("material_id"),
+            *[
+                pl.when(pl.col(c).cast(pl.String).ne_missing(pl.col(f"{c}_archive").cast(pl.String)))
+                .then(pl.struct(current=pl.col(c), archive=pl.col(f"{c}_archive")))
+                .alias(c)
+                for c in common_cols
+            ],
+        ).filter(pl.any_horizontal(pl.exclude("material_id").is_not_null()))
 
-            if differences:
-                print(f"Differences for material_id {material_id}:")
-                print(differences)
-                print('\n')
+        if not diffs.is_empty():
+            print(f"Differences for {len(diffs)} material_ids:")
+            print(diffs)
 
 
     def save(self) -> None:
-        if self.new_sheet_data.is_empty():
+        if isinstance(self.new_sheet_data, pl.DataFrame) and self.new_sheet_data.is_empty():
             print(f"No new items to add to the archive for {self.sheet_type}.")
             return
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        unique_id = uuid.uuid1()
-        if self.path.exists():
-            backup_path = self.path.replace(f"{self.path.parent / self.path.stem}_backup_{today}_{unique_id}.xlsx")
+        path = self.storage_path
+        unique_id = uuid.uuid4().hex[:12]
+        if path.exists():
+            backup_path = path.replace(f"{path.parent / path.stem}_backup_{self.today}_{unique_id}{path.suffix}")
             if not backup_path.exists():
                 raise ValueError(f"Backup was not made, stopping script. Please check that the backup file {backup_path} exists.")
-        self.new_sheet_data.write_excel(self.path)
+        if self.archive_format == 'parquet':
+            try:
+                self.new_sheet_data.lazy().sink_parquet(path, compression="zstd")
+            except pl.exceptions.InvalidOperationError:
+                # not every plan can be streamed, fall back to collecting it first
+                self.new_sheet_data.lazy().collect().write_parquet(path, compression="zstd")
+        else:
+            data = self.new_sheet_data.lazy().collect(streaming=True)
+            write_xlsx(data, path)
+            # written after the xlsx, so it's newer and read_sheet_data picks it up on the next run
+            data.write_parquet(path.with_suffix('.parquet'), compression="zstd")
+
+    @property
+    def storage_path(self) -> pathlib.Path:
+        """
+        Where the sheet data is saved: the worksheet file itself, or a .parquet next to it.
+        """
+        return self.path.with_suffix('.parquet') if self.archive_format == 'parquet' else self.path
+
+    def export_xlsx(self, path: pathlib.Path | None = None) -> None:
+        """
+        Writes the sheet data to an xlsx file (by default the worksheet file), e.g. to share it when archive_format is 'parquet'.
+        """
+        data = getattr(self, 'new_sheet_data', None)
+        if data is None or (isinstance(data, pl.DataFrame) and data.is_empty()):
+            data = self.current_sheet_data
+        write_xlsx(data.lazy().collect(streaming=True), path or self.path)
 
     def store_final_data(self) -> None:
         """
@@ -97,24 +451,35 @@ class Sheet:
         """
         self.archive.store_final_data(self.current_sheet_data)
 
+def _build_faculty_sheet(faculty: str, sheet_path: str, faculty_items_ipc: bytes, today: str, backends: tuple[XlsxReader | None, bool]) -> tuple[str, int]:
+    """
+    Updates a single faculty sheet. Top-level so it can run in a ProcessPoolExecutor worker.
+    The archive rows for the faculty are passed in as arrow ipc bytes, so the worker never opens the duckdb file.
+    The date and xlsx reader/writer come from the parent, so every sheet gets the same date and the worker doesn't probe the extensions again.
+    Returns the sheet path and the number of rows added; the sheet data itself stays in the worker.
+    """
+    use_xlsx_backends(backends)
+    sheet = Sheet(worksheet_file=File(sheet_path), sheet_type=faculty, today=today)
+    sheet.update(archive_items=pl.read_ipc(io.BytesIO(faculty_items_ipc)))
+    return sheet_path, sheet.new_item_count
+
 class CopyRightData:
-    def __init__(self, qlik_export_file: str | File, dept_mapping_path: str | File | None = None):
+    def __init__(self, qlik_export_file: str | File):
 
         if isinstance(qlik_export_file, str):
             self.qlik_export_file = File(qlik_export_file)
         else:
             self.qlik_export_file = qlik_export_file
 
-        if not dept_mapping_path:
-            dept_mapping_path = File("department_mapping.json")
-        if isinstance(dept_mapping_path, str):
-            dept_mapping_path = File(dept_mapping_path)
-
-        self.DEPARTMENT_MAPPING = json.load(open(dept_mapping_path.path, encoding='utf-8'))
-        self._data = self.to_df()
-        self._data = self.clean()
-        self._data = self.add_faculty_column()
-        self._data = self.process()
+        # the faculty column is added by the Archive, with a join on the department mapping in duckdb
+        # clean + process run as one lazy pipeline, so the frame is only rewritten once
+        self._data: pl.DataFrame = (
+            self.to_df()
+            .lazy()
+            .pipe(self.clean)
+            .pipe(self.process)
+            .collect(streaming=True)
+        )
 
     @property
     def data(self) -> pl.DataFrame:
@@ -124,40 +489,33 @@ class CopyRightData:
         """
         imports data from the Qlik export file into a Polars dataframe
         """
-        if not self._data:
-            return pl.read_excel(self.qlik_export_file.path)
+        if getattr(self, '_data', None) is None:
+            return read_xlsx(self.qlik_export_file.path)
         else:
             return self._data
 
-    def clean(self) -> pl.DataFrame:
+    def clean(self, lf: pl.LazyFrame) -> pl.LazyFrame:
         """
         cleans and preprocesses the imported data
         """
-        return self._data.rename(
+        return lf.rename(
             lambda col: col.replace(" ", "_")
             .replace("#", "count_")
             .replace("*", "x")
             .lower()
             )
 
-    def add_faculty_column(self) -> pl.DataFrame:
-        return self._data.with_columns(
-            faculty=pl.col("department").replace_strict(
-                self.DEPARTMENT_MAPPING, default="Unmapped"
-            )
-        )
-
-    def process(self) -> pl.DataFrame:
+    def process(self, lf: pl.LazyFrame) -> pl.LazyFrame:
         """
-        adds the extra columns (e.g. faculty, workflow_status) & adds 'retrieved_from_qlik' date
+        adds the extra columns (e.g. workflow_status) & adds 'retrieved_from_qlik' date
         """
-        qlik_file_created_date: str = self.qlik_export_file.created().strftime("%Y-%m-%d")
-        return self._data.with_columns(
-            pl.Series("retrieved_from_qlik", [qlik_file_created_date] * len(self._data)),
-            pl.Series("workflow_status", ["not checked"] * len(self._data)),
+        qlik_file_created_date: str = self.qlik_export_file.created.strftime("%Y-%m-%d")
+        return lf.with_columns(
+            pl.lit(qlik_file_created_date).alias("retrieved_from_qlik"),
+            pl.lit("not checked").alias("workflow_status"),
             # put remarks in the already existing 'remarks' column
             # no need for a new column
-            #pl.Series("workflow_remarks", ["-"] * len(self._data)),
+            #pl.lit("-").alias("workflow_remarks"),
         )
 
 
@@ -169,7 +527,7 @@ class Archive:
     Currently this is just a list of the qlik data as it was initially imported.
 
     '''
-    def __init__(self, db_path: str|File|None = None):
+    def __init__(self, db_path: str|File|None = None, dept_mapping_path: str | File | None = None):
         self.item_history_key_columns = ['classification', 'ml_prediction', 'manual_classification', 'last_change', 'status']
 
         if not db_path:
@@ -181,21 +539,31 @@ class Archive:
                 self.db_path = File(db_path)
             else:
                 self.db_path = db_path
-        self.con =  ibis.connect(f'duckdb://{self.db_path.name}')
-        if 'archive' in self.con.list_tables():
-            self.archive = self.con.table('archive')
-        else:
-            self.archive = None
+        self.con = ibis.connect(f'duckdb://{self.db_path.path}')
+        # the duckdb connection underneath ibis, for queries where ibis only adds overhead
+        self.raw: duckdb.DuckDBPyConnection = self.con.con
 
-        if 'item_history' in self.con.list_tables():
-            self.item_history = self.con.table('item_history')
-        else:
-            self.item_history = None
+        if not dept_mapping_path:
+            dept_mapping_path = File("department_mapping.json")
+        if isinstance(dept_mapping_path, str):
+            dept_mapping_path = File(dept_mapping_path)
+        self.DEPARTMENT_MAPPING = load_department_mapping(str(dept_mapping_path.path))
+        # small department -> faculty table, joined onto every batch of new data (see _register_new_data)
+        self.raw.register("dept_map", pl.DataFrame(
+            {"department": list(self.DEPARTMENT_MAPPING.keys()), "faculty": list(self.DEPARTMENT_MAPPING.values())},
+            schema={"department": pl.String, "faculty": pl.String},
+        ).to_arrow())
 
-        if 'current' in self.con.list_tables():
-            self.current = self.con.table('current')
-        else:
-            self.current = None
+        self._load_tables()
+
+    def _load_tables(self) -> None:
+        '''
+        Sets self.archive, self.item_history and self.current to the tables in the database, or None if they don't exist (yet).
+        '''
+        tables = self.con.list_tables()
+        self.archive = self.con.table('archive') if 'archive' in tables else None
+        self.item_history = self.con.table('item_history') if 'item_history' in tables else None
+        self.current = self.con.table('current') if 'current' in tables else None
 
     def update(self, data: CopyRightData):
         '''
@@ -207,11 +575,39 @@ class Archive:
 
         '''
         df = self.check_dataframe(data._data)
-        self.update_current(df)
-        self.update_item_history(df)
-        self.update_archive()
-
-    def update_current(self, df: pl.DataFrame):
+        # all three tables are updated on the connection ibis already holds, in one transaction
+        con = self.raw
+        con.begin()
+        try:
+            self.update_current(df, con)
+            self.update_item_history(df, con)
+            self.update_archive(con=con)
+            con.commit()
+        except Exception:
+            con.rollback()
+            # tables created in the failed transaction are gone again, so don't keep the handles to them
+            self._load_tables()
+            raise
+
+    def _register_new_data(self, con: duckdb.DuckDBPyConnection, df: pl.DataFrame) -> None:
+        '''
+        Makes df available as 'new_data' in duckdb, with the faculty column added by joining on the department mapping.
+        Undo with _unregister_new_data.
+        '''
+        con.register("incoming_data", df.to_arrow())
+        exclude = " EXCLUDE (faculty)" if "faculty" in df.columns else ""
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW new_data AS
+            SELECT incoming_data.*{exclude}, COALESCE(dept_map.faculty, 'Unmapped') AS faculty
+            FROM incoming_data
+            LEFT JOIN dept_map USING (department)
+        """)
+
+    def _unregister_new_data(self, con: duckdb.DuckDBPyConnection) -> None:
+        con.execute("DROP VIEW IF EXISTS new_data")
+        con.unregister("incoming_data")
+
+    def update_current(self, df: pl.DataFrame, con: duckdb.DuckDBPyConnection | None = None):
         '''
         takes in a dataframe with CopyRightData, and does the following:
         - for each existing material_id, update key columns (classification, ml_prediction, manual_classification, last_change, status) with the new values
@@ -220,15 +616,20 @@ class Archive:
         '''
 
         # first check the df for errors
-        with duckdb.connect(database='archive.duckdb', read_only=False) as con:
+        con = con or self.raw
+        self._register_new_data(con, df)
+        try:
             if self.current is None:
                 con.execute("""
-                    CREATE TABLE 'current' AS SELECT * FROM df;
+                    CREATE TABLE 'current' AS SELECT * FROM new_data;
                     """)
                 self.current = self.con.table('current')
             else:
-                con.execute("CREATE OR REPLACE TEMP TABLE new_data AS SELECT * FROM df")
-                con.execute("""
+                # the insert lists the columns by name: new_data has faculty last, tables made by older versions don't
+                columns = [c for c in df.columns if c != "faculty"] + ["faculty"]
+                column_list = ", ".join('"' + c.replace('"', '""') + '"' for c in columns)
+                source_list = ", ".join('source."' + c.replace('"', '""') + '"' for c in columns)
+                con.execute(f"""
                     MERGE INTO current AS target
                     USING new_data AS source
                     ON target.material_id = source.material_id
@@ -246,38 +647,38 @@ class Archive:
                             last_change = source.last_change,
                             status = source.status
                     WHEN NOT MATCHED THEN
-                        INSERT VALUES (source.*)
+                        INSERT ({column_list}) VALUES ({source_list})
                 """)
                 self.current = self.con.table('current')
+        finally:
+            self._unregister_new_data(con)
 
-    def update_item_history(self, df: pl.DataFrame):
-        with duckdb.connect(database=self.db_path, read_only=False) as con:
+    def update_item_history(self, df: pl.DataFrame, con: duckdb.DuckDBPyConnection | None = None):
+        con = con or self.raw
+        self._register_new_data(con, df)
+        try:
             if self.item_history is None:
                 con.execute("""
-                    CREATE TABLE 'item_history' AS SELECT * FROM df;
+                    CREATE TABLE 'item_history' AS SELECT * FROM new_data;
                     """)
-                self.item_history = self.con.table('current')
+                self.item_history = self.con.table('item_history')
             else:
-                con.execute("CREATE OR REPLACE TEMP TABLE new_data AS SELECT * FROM df")
-                con.execute("""
-                    INSERT INTO item_history
-                    SELECT *
+                # only rows that differ from every stored row on the key columns; NULLs count as equal to each other
+                key_columns = ["material_id", *self.item_history_key_columns]
+                condition = " AND ".join(f"new_data.{c} IS NOT DISTINCT FROM ih.{c}" for c in key_columns)
+                con.execute(f"""
+                    INSERT INTO item_history BY NAME
+                    SELECT new_data.*
                     FROM new_data
-                    WHERE NOT EXISTS (
-                        SELECT 1
-                        FROM item_history
-                        WHERE item_history.material_id = new_data.material_id
-                        AND item_history.classification = new_data.classification
-                        AND item_history.ml_prediction = new_data.ml_prediction
-                        AND item_history.manual_classification = new_data.manual_classification
-                        AND item_history.last_change = new_data.last_change
-                        AND item_history.status = new_data.status
-                    )
+                    ANTI JOIN item_history ih
+                    ON {condition}
                 """)
                 self.item_history = self.con.table('item_history')
+        finally:
+            self._unregister_new_data(con)
 
 
-    def update_archive(self, df: pl.DataFrame | None = None):
+    def update_archive(self, df: pl.DataFrame | None = None, con: duckdb.DuckDBPyConnection | None = None):
         '''
         If no archive exists, create it using the df.
         If an archive exists, add only rows which are not already in the archive.
@@ -285,47 +686,44 @@ class Archive:
 
         If rows already exist, ignore them (keep the old ones).
         '''
-        with duckdb.connect(database='archive.duckdb', read_only=False) as con:
-            if df is not None:
+        con = con or self.raw
+        if df is not None:
+            self._register_new_data(con, df)
+            try:
                 if self.archive is None:
+                    # stored in material_id order, so the row group min/max stats can skip most of the table for id lookups
                     con.execute("""
-                        CREATE TABLE 'archive' AS SELECT * FROM df;
+                        CREATE TABLE 'archive' AS SELECT * FROM new_data ORDER BY material_id;
                         """)
                     self.archive = self.con.table('archive')
                 else:
-                    con.execute("CREATE OR REPLACE TEMP TABLE new_data AS SELECT * FROM df")
                     con.execute("""
-                        INSERT INTO archive
+                        INSERT INTO archive BY NAME
                         SELECT new_data.*
                         FROM new_data
-                        WHERE NOT EXISTS (
-                            SELECT 1
-                            FROM archive
-                            WHERE archive.material_id = new_data.material_id
-                        )
+                        ANTI JOIN archive USING (material_id)
                     """)
 
                     self.archive = self.con.table('archive')
-            else:
-                con.execute("""
-                    INSERT INTO archive
-                    SELECT
-                        ih.*
-                    FROM item_history ih
-                    INNER JOIN (
-                        SELECT material_id, MIN(retrieved_from_qlik) as min_retrieved_date
-                        FROM item_history
-                        WHERE material_id NOT IN (SELECT material_id FROM archive)
-                        GROUP BY material_id
-                    ) AS earliest_entries
-                    ON ih.material_id = earliest_entries.material_id
-                    AND ih.retrieved_from_qlik = earliest_entries.min_retrieved_date
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM archive a
-                        WHERE a.material_id = ih.material_id
-                    )
-                """)
-                self.archive = self.con.table('archive')
+            finally:
+                self._unregister_new_data(con)
+        else:
+            # the ids already in the archive are dropped with an anti join before grouping, so only new ids are aggregated
+            con.execute("""
+                INSERT INTO archive BY NAME
+                SELECT
+                    ih.*
+                FROM item_history ih
+                INNER JOIN (
+                    SELECT material_id, MIN(retrieved_from_qlik) as min_retrieved_date
+                    FROM item_history
+                    ANTI JOIN archive USING (material_id)
+                    GROUP BY material_id
+                ) AS earliest_entries
+                ON ih.material_id = earliest_entries.material_id
+                AND ih.retrieved_from_qlik = earliest_entries.min_retrieved_date
+            """)
+            self.archive = self.con.table('archive')
 
     def store_final_data(self, df: pl.DataFrame) -> None:
         '''
@@ -333,31 +731,67 @@ class Archive:
         '''
 
 
-    def get(self, data: str = 'archive', search_terms: list[tuple[str, str]]|None = None) -> pl.DataFrame:
+    def get(self, data: str = 'archive', search_terms: list[tuple[str, str]]|None = None, columns: list[str] | None = None, ids: pl.Series | None = None) -> pl.DataFrame:
         '''
         get specific rows from an archive table
         data should be one of 'archive', 'current', or 'item_history' -- i.e. the name of the table to get data from
-        search_terms should be a list with dictionaries with shape {'field_name': 'value'}
+        search_terms should be a list of (field_name, value) tuples
         if search_terms is None, return all rows
+        columns is the list of columns to return; if None, return all columns
+        ids is a series of material_ids to get the rows for; this is a semi join in duckdb, use it instead of search_terms for many ids
         '''
-        if data == 'archive':
-            table = self.archive
-        elif data == 'current':
-            table = self.current
-        elif data == 'item_history':
-            table = self.item_history
-
-        if search_terms is None:
-            return table.to_polars()
-        else:
-            #TODO: test this!!
-            # return all rows from self.archive where all conditions in the search terms are met
+        if data not in ('archive', 'current', 'item_history'):
+            raise ValueError(f"Unknown table {data}, should be one of 'archive', 'current', or 'item_history'.")
+
+        # straight to duckdb and arrow, no ibis expression needed for a simple filter
+        select = ", ".join('"' + column.replace('"', '""') + '"' for column in columns) if columns else "*"
+        sql = f'SELECT {select} FROM "{data}" t'
+        if ids is not None:
+            # the sheet ids are strings, while the archive keeps the numeric ids from the export: compare both as VARCHAR
+            sql += " SEMI JOIN _ids ON CAST(t.material_id AS VARCHAR) = _ids.material_id"
+        params: list = []
+        if search_terms:
             # search terms are a list of tuples, where the first element is the column name, and the second element is the value to match
             # e.g. [('material_id', '12345'), ('workflow_status', 'not checked')]
-            filtered = table
+            # all terms have to match; if a column is given more than once, any of its values can match (e.g. a list of material_ids)
+            values_per_column: dict[str, list] = {}
             for key, value in search_terms:
-                filtered = filtered.filter(filtered[key] == value)
-            return filtered.to_polars()
+                values_per_column.setdefault(key, []).append(value)
+            predicates = []
+            for key, values in values_per_column.items():
+                column = '"' + key.replace('"', '""') + '"'
+                predicates.append(f"{column} = ?" if len(values) == 1 else f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            sql += " WHERE " + " AND ".join(predicates)
+        if ids is None:
+            return pl.from_arrow(self.raw.execute(sql, params).arrow())
+        self.raw.register("_ids", ids.cast(pl.String).alias("material_id").to_frame().to_arrow())
+        try:
+            return pl.from_arrow(self.raw.execute(sql, params).arrow())
+        finally:
+            self.raw.unregister("_ids")
+
+    def get_partitioned(self, by: str = 'faculty', data: str = 'archive') -> dict[str, pl.DataFrame]:
+        '''
+        get all rows from an archive table in one query, split into a frame per value of column `by`.
+        '''
+        return {key: part for (key,), part in self.get(data=data).partition_by(by, as_dict=True).items()}
+
+    def get_new(self, current_ids: pl.DataFrame, faculty: str | None = None) -> pl.DataFrame:
+        '''
+        get the rows from the archive whose material_id is not in current_ids (a frame with a 'material_id' column),
+        optionally only for one faculty. The anti join runs in duckdb, so only the new rows are pulled into polars.
+        '''
+        con = self.raw
+        con.register("cur_ids", current_ids.select("material_id").to_arrow())
+        try:
+            # compared as VARCHAR, same as the polars anti join in Sheet.update: sheet ids are strings, archive ids are numeric
+            query = "SELECT a.* FROM archive a ANTI JOIN cur_ids c ON CAST(a.material_id AS VARCHAR) = CAST(c.material_id AS VARCHAR)"
+            if faculty is None:
+                return con.execute(query).pl()
+            return con.execute(query + " WHERE a.faculty = ?", [faculty]).pl()
+        finally:
+            con.unregister("cur_ids")
 
     def check_dataframe(self, df: pl.DataFrame) -> pl.DataFrame:
         '''
@@ -367,6 +801,29 @@ class Archive:
         '''
         return df
 
+    def close(self) -> None:
+        '''
+        close the duckdb connection. The Archive can't be used afterwards.
+        If this is the shared default_archive(), it's dropped from the cache, so the next call opens a new one.
+        '''
+        if default_archive.cache_info().currsize and default_archive() is self:
+            default_archive.cache_clear()
+        self.con.disconnect()
+
+    def __enter__(self) -> 'Archive':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+@functools.lru_cache(maxsize=None)
+def default_archive() -> Archive:
+    """
+    The Archive for the DUCKDB_PATH database, shared by everything in this process that doesn't get one passed in,
+    so the database is only connected to (and its catalog loaded) once.
+    """
+    return Archive()
+
 class EasyAccess:
     ...
     '''
@@ -380,56 +837,80 @@ class EasyAccess:
     '''
 
     def __init__(self):
-        self.archive = Archive()
+        self.archive = default_archive()
 
         self.copyright_data_dir = Directory(os.getenv("QLIK_EXPORTS_DIR"))
         self.faculty_sheet_dir = Directory(os.getenv("FACULTY_SHEETS_DIR"))
         self.cip_worksheet_path = File(os.path.join(os.getenv("CIP_WORKSHEET_DIR"), "all.xlsx"))
         self.copyright_data, self.previous_copyright_data = self.get_latest_export()
+        # every sheet made in this run (faculty sheets and the all sheet)
         self.sheets: list[Sheet] = []
+        # faculty sheet path -> number of rows added in this run
+        self.faculty_sheets: dict[str, int] = {}
 
     def get_latest_export(self) -> tuple[CopyRightData, CopyRightData]:
         """
         Scan all files in self.copyright_data_dir and return the 2 latest ones.
         Use the created date to determine which file to return.
         """
-        all_files = self.copyright_data_dir.files
-        latest_file = max(all_files, key=lambda x: x.created())
-        previous_file = max(all_files, key=lambda x: x.created(), default=latest_file)
+        # Directory.files reuses the scandir stat results, and File.created is cached, so this is one stat per file
+        latest_files = heapq.nlargest(2, self.copyright_data_dir.files, key=lambda x: x.created)
+        latest_file = latest_files[0]
+        previous_file = latest_files[1] if len(latest_files) > 1 else latest_file
         return CopyRightData(qlik_export_file=latest_file), CopyRightData(qlik_export_file=previous_file)
 
     def run(self) -> None:
         for data in [self.previous_copyright_data, self.copyright_data]:
             print('storing data in archive')
             self.archive.update(data)
-            print('calling self.archive.get()')
-            all_data = self.archive.get(data='archive', search_terms=None)
-            print('calling self.list_faculties()')
-            faculties = self.list_faculties(all_data)
-            print('calling self.create_faculty_sheets()')
-            self.create_faculty_sheets(faculties)
-            print('calling Sheet().update()')
-            all_sheet=Sheet(worksheet_file=self.cip_worksheet_path, sheet_type='all')
-            all_sheet.update()
-            print('appending all_sheet to self.sheets')
-            self.sheets.append(all_sheet)
-
-    def create_faculty_sheets(self, faculties: list[str]) -> None:
+        # the sheets are only built once, from the archive with both exports in it
+        print('calling self.archive.get_partitioned()')
+        items_per_faculty = self.archive.get_partitioned(by='faculty')
+        faculties = list(items_per_faculty)
+        print('calling self.create_faculty_sheets()')
+        self.create_faculty_sheets(faculties, items_per_faculty)
+        print('calling Sheet().update()')
+        all_sheet=Sheet(worksheet_file=self.cip_worksheet_path, sheet_type='all', archive=self.archive)
+        all_sheet.update()
+        print('appending all_sheet to self.sheets')
+        self.sheets.append(all_sheet)
+
+    def create_faculty_sheets(self, faculties: list[str], items_per_faculty: dict[str, pl.DataFrame] | None = None) -> None:
         """
         Create a sheet for each faculty in the faculties list.
+        items_per_faculty is the archive split per faculty (see Archive.get_partitioned) if it has already been retrieved,
+        so it doesn't have to be queried again.
         """
+        # the archive is read and split once; the workers only get the rows for their faculty,
+        # as they can't open the duckdb file while this process holds it
+        if items_per_faculty is None:
+            items_per_faculty = self.archive.get_partitioned(by='faculty')
+        # found once here, and handed to the workers
+        backends = xlsx_backends()
+        jobs = []
         for faculty in faculties:
+            faculty_items = items_per_faculty.get(faculty, pl.DataFrame())
             if faculty is None:
                 faculty = "no_faculty_found"
             elif faculty == "":
                 faculty = "no_faculty_found"
             sheet_name = str(faculty) + ".xlsx"
-            fac_sheet_path = File(os.path.join(self.faculty_sheet_dir.full, sheet_name))
+            fac_sheet_path = os.path.join(self.faculty_sheet_dir.full, sheet_name)
 
+            buffer = io.BytesIO()
+            faculty_items.write_ipc(buffer)
+            jobs.append((faculty, fac_sheet_path, buffer.getvalue(), TODAY_STR, backends))
 
-            sheet = Sheet(worksheet_file=fac_sheet_path, sheet_type=faculty)
-            sheet.update()
-            self.sheets.append(sheet)
+        if not jobs:
+            return
+        # spawn, not fork: a forked child can deadlock on the polars/duckdb thread pools of this process
+        with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 8, len(jobs)), mp_context=multiprocessing.get_context("spawn")) as executor:
+            self.faculty_sheets.update(executor.map(_build_faculty_sheet, *zip(*jobs)))
+        # handles to the written sheets; their data is only read from disk if it's used
+        self.sheets.extend(
+            Sheet(worksheet_file=File(sheet_path), sheet_type=faculty, archive=self.archive, today=TODAY_STR)
+            for faculty, sheet_path, *_ in jobs
+        )
 
 
 
@@ -442,6 +923,11 @@ class EasyAccess:
         return faculties
 
 if __name__ == "__main__":
+    # setup step, needs network access: python new.py --install-extensions
+    if "--install-extensions" in sys.argv:
+        install_xlsx_extensions()
+        sys.exit()
+
     c = duckdb.connect(database='archive.duckdb', read_only=False)
     c.close()
 
@@ -0,0 +1,55 @@
+import duckdb
+import polars as pl
+
+import functions
+
+
+def test_export_sheets_parquet_all_data(tmp_path):
+    db_path = str(tmp_path / "data.duckdb")
+    with duckdb.connect(database=db_path) as con:
+        con.execute("CREATE TABLE easy_access AS SELECT * FROM (VALUES (1, 'TNW'), (2, 'EEMCS')) AS t(material_id, faculty)")
+
+    functions.export_sheets(sheets_path=str(tmp_path), duckdb_path=db_path, all_faculties=False, date="2024-10-01", format="parquet")
+
+    df = pl.read_parquet(tmp_path / "all" / "2024-10-01" / "all.parquet")
+    assert df.sort("material_id").to_dicts() == [
+        {"material_id": 1, "faculty": "TNW", "export_date": "2024-10-01"},
+        {"material_id": 2, "faculty": "EEMCS", "export_date": "2024-10-01"},
+    ]
+
+
+def _write_export_csv(path):
+    pl.DataFrame(
+        {
+            "Material ID": [1, 2, 3],
+            "Department": ["M-ME: Mechanical Engineering", "M-CS: Computer Science", "Not a department"],
+            "#Students": [10, None, 30],
+            "Period": ["2024-1A", "2024-1B", "2024-2A"],
+        }
+    ).write_csv(path)
+
+
+def test_process_data_direct_csv(tmp_path):
+    csv_path = str(tmp_path / "export.csv")
+    db_path = str(tmp_path / "data.duckdb")
+    _write_export_csv(csv_path)
+
+    functions.process_data_direct(csv_path, db_path)
+
+    with duckdb.connect(database=db_path, read_only=True) as con:
+        df = con.execute("SELECT * FROM easy_access ORDER BY material_id").pl()
+    assert df.columns == ["material_id", "department", "count_students", "period", "faculty"]
+    assert df["faculty"].to_list() == ["ET", "EEMCS", "Unmapped"]
+    assert df["count_students"].to_list() == [10, None, 30]
+
+
+def test_process_data_polars_pipeline_filters_periods(tmp_path):
+    csv_path = str(tmp_path / "export.csv")
+    db_path = str(tmp_path / "data.duckdb")
+    _write_export_csv(csv_path)
+
+    functions.process_data(csv_path, periods=["2024-1A", "2024-1B"], dbpath=db_path, direct=False)
+
+    with duckdb.connect(database=db_path, read_only=True) as con:
+        df = con.execute("SELECT material_id, CAST(faculty AS VARCHAR) AS faculty FROM easy_access ORDER BY material_id").pl()
+    assert df.rows() == [(1, "ET"), (2, "EEMCS")]